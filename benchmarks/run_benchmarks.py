@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+'''
+Runs CirculoCov on simulated data and compares each stage to a baseline
+
+EXAMPLE:
+python benchmarks/run_benchmarks.py --scenarios bacterial draft --scale 0.1 -t 4
+python benchmarks/run_benchmarks.py --scale 0.1 --update_baseline
+'''
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from simulate import SCENARIOS, simulate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def run_scenario(scenario, files, args):
+    ''' Runs circulocov once and collects its run metrics and peak memory '''
+
+    out = os.path.join(args.out, scenario)
+    if os.path.exists(out):
+        shutil.rmtree(out)
+
+    # no index cache, so every run builds its own index like a first run would
+    command = ['circulocov',
+               '-g', files['genome'],
+               '-s', scenario,
+               '-o', out,
+               '-t', str(args.threads),
+               '-a',
+               '--index_cache_size', '0']
+    for platform in args.platforms:
+        command += ['-i'] + files['illumina'] if platform == 'illumina' else ['--' + platform, files[platform]]
+
+    logging.info(f"Running {' '.join(command)}")
+    log = os.path.join(args.out, scenario + '.log')
+    with open(log, 'w', encoding='utf-8') as stderr:
+        start   = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr)
+
+        # wait4 gives the peak memory of this run alone, including the processes it started
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        logging.fatal(f'circulocov failed on {scenario}, see {log}')
+        sys.exit(1)
+
+    with open(os.path.join(out, 'run_metrics.json'), 'r', encoding='utf-8') as handle:
+        metrics = json.load(handle)
+
+    # platforms run side by side, so their stage times are added up. The process peak only grows from
+    # one stage to the next, so a stage is held to the memory it adds between its start and end
+    stages = {}
+    for record in metrics['stages']:
+        entry = stages.setdefault(record['stage'], {'wall_seconds': 0, 'cpu_seconds': 0, 'rss_growth_mb': 0})
+        entry['wall_seconds']  = round(entry['wall_seconds'] + record['wall_seconds'], 3)
+        entry['cpu_seconds']   = round(entry['cpu_seconds'] + record['cpu_seconds'] + record['child_cpu_seconds'], 3)
+        if record['rss_start_mb'] is not None and record['rss_end_mb'] is not None:
+            entry['rss_growth_mb'] = round(max(entry['rss_growth_mb'], record['rss_end_mb'] - record['rss_start_mb']), 1)
+
+    contigs = SCENARIOS[scenario](args.scale)
+    return {'contigs':      len(contigs),
+            'genome_size':  sum(length for _, length, _ in contigs),
+            'wall_seconds': round(wall, 3),
+            'peak_rss_mb':  round(usage.ru_maxrss / 1024, 1),
+            'stages':       stages}
+
+def regressions(results, baseline, args):
+    ''' Lists every time or memory that grew past the tolerance '''
+
+    found = []
+
+    def check(name, new, old, floor):
+        if old is not None and new > old * (1 + args.tolerance) and new - old > floor:
+            found.append(f'{name} went from {old} to {new}')
+
+    for scenario, result in results['scenarios'].items():
+        if scenario not in baseline['scenarios']:
+            continue
+        old = baseline['scenarios'][scenario]
+
+        check(f'{scenario} wall_seconds', result['wall_seconds'], old['wall_seconds'], args.min_seconds)
+        check(f'{scenario} peak_rss_mb',  result['peak_rss_mb'],  old['peak_rss_mb'],  args.min_mb)
+        for stage, entry in result['stages'].items():
+            old_stage = old['stages'].get(stage, {})
+            check(f'{scenario} {stage} wall_seconds', entry['wall_seconds'], old_stage.get('wall_seconds'), args.min_seconds)
+            check(f'{scenario} {stage} rss_growth_mb', entry['rss_growth_mb'], old_stage.get('rss_growth_mb'), args.min_mb)
+
+    return found
+
+def main():
+    ''' Simulates, runs and compares every scenario '''
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios',
+                        nargs = '+',
+                        choices = list(SCENARIOS),
+                        help = 'Assemblies to simulate',
+                        default = list(SCENARIOS))
+    parser.add_argument('--platforms',
+                        nargs = '+',
+                        choices = ['nanopore', 'illumina', 'pacbio'],
+                        help = 'Reads to simulate',
+                        default = ['nanopore', 'illumina'])
+    parser.add_argument('--scale',
+                        type = float,
+                        help = 'Fraction of the full genome sizes to simulate',
+                        default = 1.0)
+    parser.add_argument('--data',
+                        type = str,
+                        help = 'Directory for simulated genomes and reads, reused between runs',
+                        default = os.path.join(HERE, 'data'))
+    parser.add_argument('-o', '--out',
+                        type = str,
+                        help = 'Directory for circulocov results and benchmark_results.json',
+                        default = os.path.join(HERE, 'results'))
+    parser.add_argument('--baseline',
+                        type = str,
+                        help = 'Baseline to compare against',
+                        default = os.path.join(HERE, 'baseline.json'))
+    parser.add_argument('--update_baseline',
+                        action = 'store_true',
+                        help = 'Replace the baseline with these results')
+    parser.add_argument('--tolerance',
+                        type = float,
+                        help = 'Allowed growth over the baseline as a fraction',
+                        default = 0.25)
+    parser.add_argument('--min_seconds',
+                        type = float,
+                        help = 'Time differences smaller than this are never regressions',
+                        default = 1.0)
+    parser.add_argument('--min_mb',
+                        type = float,
+                        help = 'Memory differences smaller than this are never regressions',
+                        default = 50)
+    parser.add_argument('-t', '--threads',
+                        type = int,
+                        help = 'Number of threads for circulocov',
+                        default = 4)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(message)s',
+        datefmt = '%y-%b-%d %H:%M:%S',
+        level=logging.INFO)
+
+    os.makedirs(args.out, exist_ok=True)
+
+    results = {'scale':     args.scale,
+               'threads':   args.threads,
+               'platforms': args.platforms,
+               'scenarios': {}}
+    for scenario in args.scenarios:
+        files = simulate(scenario, args.scale, args.data, args.platforms)
+        results['scenarios'][scenario] = run_scenario(scenario, files, args)
+
+        result = results['scenarios'][scenario]
+        logging.info(f"{scenario} : {result['wall_seconds']} seconds, {result['peak_rss_mb']} MB")
+        for stage, entry in result['stages'].items():
+            logging.info(f"    {stage:<18} {entry['wall_seconds']:>10} seconds {entry['rss_growth_mb']:>10} MB added")
+
+    with open(os.path.join(args.out, 'benchmark_results.json'), 'w', encoding='utf-8') as handle:
+        json.dump(results, handle, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as handle:
+            json.dump(results, handle, indent=2)
+        logging.info(f'Baseline written to {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        logging.warning(f'No baseline at {args.baseline}, run with --update_baseline to make one')
+        return
+
+    with open(args.baseline, 'r', encoding='utf-8') as handle:
+        baseline = json.load(handle)
+
+    # times only compare between runs of the same size
+    for setting in ['scale', 'threads', 'platforms']:
+        if baseline[setting] != results[setting]:
+            logging.warning(f'The baseline was made with {setting} {baseline[setting]}, not {results[setting]}, so it was not compared')
+            return
+
+    found = regressions(results, baseline, args)
+    for regression in found:
+        logging.error(f'Regression : {regression}')
+
+    if found:
+        sys.exit(1)
+
+    logging.info('No regressions against the baseline')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+'''
+Simulates assemblies and reads for benchmarking CirculoCov
+
+Genomes are random sequence with circular=true on closed contigs. Reads are
+sampled uniformly from both strands (wrapping around the end of circular
+contigs) with substitution errors only, which is enough for minimap2 to
+behave like it does on real data.
+'''
+
+import gzip
+import logging
+import os
+import numpy as np
+
+BASES      = np.frombuffer(b'ACGT', dtype=np.uint8)
+COMPLEMENT = bytes.maketrans(b'ACGT', b'TGCA')
+
+# name : list of (contig name, length, circular) built from the scale
+SCENARIOS = {
+    'bacterial': lambda scale: [('chromosome', int(5_000_000 * scale), True),
+                                ('plasmid_1',  int(150_000 * scale),   True),
+                                ('plasmid_2',  int(40_000 * scale),    True),
+                                ('plasmid_3',  int(8_000 * scale),     True)],
+    # scaling a draft keeps its contig lengths and drops contigs instead
+    'draft':     lambda scale: [(f'contig_{i + 1}', 1_000 + int(20_000 * 0.999 ** (i / scale)), False)
+                                for i in range(max(int(10_000 * scale), 10))],
+    'large':     lambda scale: [(f'chromosome_{i + 1}', int(length * scale), circular)
+                                for i, (length, circular) in enumerate([(40_000_000, False),
+                                                                        (30_000_000, False),
+                                                                        (20_000_000, False),
+                                                                        (9_500_000,  False),
+                                                                        (500_000,    True)])],
+}
+
+# read length, errors, and depth for each platform
+PLATFORMS = {'nanopore': {'mean_length': 8_000,  'error': 0.05,  'depth': 20},
+             'illumina': {'read_length': 150,    'insert':    400, 'error': 0.005, 'depth': 20},
+             'pacbio':   {'mean_length': 15_000, 'error': 0.01,  'depth': 10}}
+
+def simulate_genome(contigs, fasta, rng):
+    ''' Writes random contigs to a fasta and returns their sequences '''
+
+    sequences = {}
+    with open(fasta, 'w', encoding='utf-8') as handle:
+        for name, length, circular in contigs:
+            sequence = BASES[rng.integers(0, 4, length)].tobytes()
+            sequences[name] = (sequence, circular)
+
+            handle.write(f'>{name}' + (' circular=true' if circular else '') + '\n')
+            for start in range(0, length, 80):
+                handle.write(sequence[start:start + 80].decode() + '\n')
+
+    return sequences
+
+def sample_fragments(sequences, lengths, rng):
+    ''' Picks fragments from contigs in proportion to their length, wrapping around circular ones '''
+
+    names   = list(sequences)
+    weights = np.array([len(sequences[name][0]) for name in names], dtype=np.float64)
+    picks   = rng.choice(len(names), size=len(lengths), p=weights / weights.sum())
+
+    for pick, length in zip(picks, lengths):
+        sequence, circular = sequences[names[pick]]
+        if circular:
+            start    = rng.integers(0, len(sequence))
+            fragment = sequence[start:start + length] + sequence[:max(start + length - len(sequence), 0)]
+            fragment = fragment[:len(sequence)]
+        else:
+            start    = rng.integers(0, max(len(sequence) - length, 0) + 1)
+            fragment = sequence[start:start + length]
+
+        if rng.random() < 0.5:
+            fragment = fragment.translate(COMPLEMENT)[::-1]
+
+        yield fragment
+
+def add_errors(read, error, rng):
+    ''' Swaps a fraction of the bases for random ones '''
+
+    read = np.frombuffer(read, dtype=np.uint8).copy()
+    hits = np.flatnonzero(rng.random(len(read)) < error)
+    read[hits] = BASES[rng.integers(0, 4, len(hits))]
+
+    return read.tobytes()
+
+def simulate_long_reads(sequences, fastq, settings, rng):
+    ''' Writes nanopore or pacbio reads with lognormal lengths '''
+
+    genome_size = sum(len(sequence) for sequence, _ in sequences.values())
+    total_bases = genome_size * settings['depth']
+    count       = max(int(total_bases / settings['mean_length']), 1)
+    lengths     = rng.lognormal(np.log(settings['mean_length']), 0.5, count).astype(int).clip(500, None)
+
+    with gzip.open(fastq, 'wb', compresslevel=1) as handle:
+        for i, fragment in enumerate(sample_fragments(sequences, lengths, rng)):
+            read = add_errors(fragment, settings['error'], rng)
+            handle.write(b'@read_' + str(i).encode() + b'\n' + read + b'\n+\n' + b'5' * len(read) + b'\n')
+
+def simulate_paired_reads(sequences, fastqs, settings, rng):
+    ''' Writes paired illumina reads from the ends of each fragment '''
+
+    genome_size = sum(len(sequence) for sequence, _ in sequences.values())
+    total_bases = genome_size * settings['depth']
+    count       = max(int(total_bases / (2 * settings['read_length'])), 1)
+    inserts     = rng.normal(settings['insert'], settings['insert'] / 10, count).astype(int).clip(settings['read_length'], None)
+    quality     = b'I' * settings['read_length']
+
+    with gzip.open(fastqs[0], 'wb', compresslevel=1) as read1, gzip.open(fastqs[1], 'wb', compresslevel=1) as read2:
+        for i, fragment in enumerate(sample_fragments(sequences, inserts, rng)):
+            if len(fragment) < settings['read_length']:
+                continue
+
+            first  = add_errors(fragment[:settings['read_length']], settings['error'], rng)
+            second = add_errors(fragment[-settings['read_length']:].translate(COMPLEMENT)[::-1], settings['error'], rng)
+            name   = b'@pair_' + str(i).encode()
+            read1.write(name + b'/1\n' + first + b'\n+\n' + quality + b'\n')
+            read2.write(name + b'/2\n' + second + b'\n+\n' + quality + b'\n')
+
+def simulate(scenario, scale, directory, platforms, seed = 42):
+    ''' Creates the genome and reads for a scenario, reusing files made earlier '''
+
+    directory = os.path.join(directory, f'{scenario}_{scale}_{seed}')
+    os.makedirs(directory, exist_ok=True)
+
+    files = {'genome':   os.path.join(directory, 'genome.fasta'),
+             'nanopore': os.path.join(directory, 'nanopore.fastq.gz'),
+             'illumina': [os.path.join(directory, 'illumina_R1.fastq.gz'),
+                          os.path.join(directory, 'illumina_R2.fastq.gz')],
+             'pacbio':   os.path.join(directory, 'pacbio.fastq.gz')}
+
+    done = os.path.join(directory, 'done')
+    if os.path.exists(done):
+        with open(done, 'r', encoding='utf-8') as handle:
+            if set(platforms) <= set(handle.read().split()):
+                return files
+
+    logging.info(f'Simulating {scenario} at scale {scale} in {directory}')
+    rng       = np.random.default_rng(seed)
+    sequences = simulate_genome(SCENARIOS[scenario](scale), files['genome'], rng)
+
+    for platform in platforms:
+        logging.info(f'Simulating {platform} reads for {scenario}')
+        if platform == 'illumina':
+            simulate_paired_reads(sequences, files['illumina'], PLATFORMS['illumina'], rng)
+        else:
+            simulate_long_reads(sequences, files[platform], PLATFORMS[platform], rng)
+
+    with open(done, 'w', encoding='utf-8') as handle:
+        handle.write(' '.join(platforms) + '\n')
+
+    return files
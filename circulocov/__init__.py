@@ -0,0 +1,3 @@
+''' Circular-Aware Coverage for Draft Genomes '''
+
+from .api import Config, Result, run
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=R0902
+
+'''
+Runs CirculoCov from python without the command line
+
+EXAMPLE:
+from circulocov import Config, run
+result = run(Config(genome='genome.fasta', nanopore='nanopore.fastq.gz', out='out', all=True))
+result.summary
+'''
+
+import argparse
+import importlib.util
+import logging
+import shutil
+from dataclasses import dataclass, field, fields
+from typing import Optional
+
+@dataclass
+class Config:
+    ''' Settings for one sample, with the same names and defaults as the command line options '''
+
+    genome:             str
+    sample:             str                 = 'circulocov'
+    illumina:           Optional[list[str]] = None
+    nanopore:           Optional[str]       = None
+    pacbio:             Optional[str]       = None
+    all:                bool                = False
+    padding:            int                 = 10000
+    lift:               bool                = False
+    subsample_depth:    Optional[float]     = None
+    subsample_fraction: Optional[float]     = None
+    window:             int                 = 100
+    min_mapq:           int                 = 0
+    include_flags:      int                 = 0
+    exclude_flags:      Optional[int]       = None
+    min_length:         int                 = 0
+    pyramid:            list[int]           = field(default_factory = lambda: [100, 1000, 10000])
+    depth_format:       str                 = 'tsv'
+    compress_store:     bool                = False
+    stream:             Optional[bool]      = None
+    max_memory:         float               = 16
+    index_cache:        Optional[str]       = None
+    index_cache_size:   float               = 10
+    resume:             bool                = False
+    add:                bool                = False
+    out:                str                 = 'CirculoCov'
+    threads:            int                 = 4
+
+    def to_args(self):
+        ''' Turns the settings into the namespace the stages read '''
+
+        args = argparse.Namespace(**{setting.name: getattr(self, setting.name) for setting in fields(self)})
+
+        # a single illumina file can be given as a string
+        if isinstance(args.illumina, str):
+            args.illumina = [args.illumina]
+        args.pyramid = list(args.pyramid)
+
+        return args
+
+@dataclass
+class Result:
+    ''' Tables from one run, also written to the result directory '''
+
+    sample:   str
+    out:      str
+    summary:  object
+    coverage: object
+    depth:    object
+
+def check(config):
+    ''' Raises ValueError for settings the command line would have refused '''
+
+    if not config.genome:
+        raise ValueError('A genome is needed')
+
+    if not config.illumina and not config.nanopore and not config.pacbio:
+        raise ValueError('Cannot run without fastq files')
+
+    if any(windows < 1 for windows in config.pyramid):
+        raise ValueError('pyramid window numbers must be positive')
+
+    if config.subsample_depth is not None and config.subsample_fraction is not None:
+        raise ValueError('subsample_depth and subsample_fraction cannot be used together')
+
+    if config.subsample_depth is not None and config.subsample_depth <= 0:
+        raise ValueError('subsample_depth must be positive')
+
+    if config.subsample_fraction is not None and not 0 < config.subsample_fraction <= 1:
+        raise ValueError('subsample_fraction must be between 0 and 1')
+
+    if config.depth_format not in ['tsv', 'parquet', 'feather', 'store']:
+        raise ValueError(f'Unknown depth format {config.depth_format}')
+
+    if config.depth_format in ['parquet', 'feather'] and not importlib.util.find_spec('pyarrow'):
+        raise ValueError(f'pyarrow is needed to write {config.depth_format} files')
+
+    if not shutil.which('minimap2'):
+        raise ValueError('Minimap2 not found')
+
+def run(config):
+    ''' Runs every stage for one sample and returns its summary, coverage and depth tables '''
+
+    check(config)
+
+    # pandas and pysam are only imported on the first run, so importing circulocov stays fast
+    from circulocov.utils.pipeline import pipeline # pylint: disable=C0415
+
+    logging.debug(f'Running {config.sample} from python')
+    df_summary, df_cov, df_depth = pipeline(config.to_args())
+
+    return Result(sample   = config.sample,
+                  out      = config.out,
+                  summary  = df_summary,
+                  coverage = df_cov,
+                  depth    = df_depth)
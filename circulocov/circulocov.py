@@ -24,17 +24,10 @@ import logging
 import os
 import sys
 import subprocess
-import tempfile
-import pandas as pd
 
 #from utils.circular import circular
-from circulocov.utils.genome_prep       import genome_prep
-from circulocov.utils.mapping           import mapping
-from circulocov.utils.counts            import counts
-from circulocov.utils.merge_dataframe   import merge_cov_dataframe, merge_depth_dataframe
-from circulocov.utils.summary           import summary
-from circulocov.utils.visualize         import visualize
-from circulocov.utils.extract           import extract
+# pipeline, batch and depth_store bring in pandas and pysam, so they are
+# only imported once the arguments are parsed and -v or -h have exited
 
 def main():
     ''' Get coverage for draft genomes '''
@@ -52,7 +45,7 @@ def main():
                         help = 'Sample name',
                         default= 'circulocov')
     parser.add_argument('-g', '--genome',
-                        required = True,
+                        required = False,
                         type = str,
                         help = 'Genome (draft or complete)')
     parser.add_argument('-i', '--illumina',
@@ -68,6 +61,10 @@ def main():
                         required = False,
                         type = str,
                         help ='Input pacbio fastq')
+    parser.add_argument('--samplesheet',
+                        required = False,
+                        type = str,
+                        help = 'Tab-delimited sample sheet with sample, genome, illumina, nanopore, and pacbio columns')
     parser.add_argument('-a', '--all',
                         action=argparse.BooleanOptionalAction)
     parser.add_argument('-d', '--padding',
@@ -75,11 +72,92 @@ def main():
                         type = int,
                         help = 'Amount of padding added to circular sequences',
                         default = 10000)
+    parser.add_argument('--lift',
+                        action = argparse.BooleanOptionalAction,
+                        help = 'Move alignments on the padding of circular contigs back to the original coordinates while mapping, so the bam and depth tables use the original contig lengths',
+                        default = False)
+    parser.add_argument('--subsample_depth',
+                        required = False,
+                        type = float,
+                        help = 'Subsample reads to about this depth of sequenced bases before mapping, reporting the depth the full read set would have had in the summary',
+                        default = None)
+    parser.add_argument('--subsample_fraction',
+                        required = False,
+                        type = float,
+                        help = 'Subsample this fraction of the reads before mapping (between 0 and 1)',
+                        default = None)
     parser.add_argument('-w', '--window',
                         required = False,
                         type = int,
                         help = 'Number of windows for coverage',
                         default = 100)
+    parser.add_argument('--min_mapq',
+                        required = False,
+                        type = int,
+                        help = 'Only count alignments with at least this mapping quality',
+                        default = 0)
+    parser.add_argument('--include_flags',
+                        required = False,
+                        type = lambda value: int(value, 0),
+                        help = 'Only count alignments with any of these flags set (like samtools coverage --rf)',
+                        default = 0)
+    parser.add_argument('--exclude_flags',
+                        required = False,
+                        type = lambda value: int(value, 0),
+                        help = 'Skip alignments with any of these flags set (default for coverage and depth: 0x704, like samtools coverage --ff)',
+                        default = None)
+    parser.add_argument('--min_length',
+                        required = False,
+                        type = int,
+                        help = 'Only count reads at least this long, measured from the CIGAR like samtools coverage -l',
+                        default = 0)
+    parser.add_argument('--pyramid',
+                        nargs = '+',
+                        required = False,
+                        type = int,
+                        help = 'Numbers of windows for the mean, min, max and median depth pyramid',
+                        default = [100, 1000, 10000])
+    parser.add_argument('--depth_format',
+                        required = False,
+                        type = str,
+                        choices = ['tsv', 'parquet', 'feather', 'store'],
+                        help = 'File format for the depth tables (parquet and feather need pyarrow, store writes per-base depth to a binary .ccd file)',
+                        default = 'tsv')
+    parser.add_argument('--compress_store',
+                        action = argparse.BooleanOptionalAction,
+                        help = 'Compress the binary depth store in chunks',
+                        default = False)
+    parser.add_argument('--stream',
+                        action = argparse.BooleanOptionalAction,
+                        help = 'Count and write depth one contig at a time (turned on automatically when the depth tables would not fit in --max_memory)')
+    parser.add_argument('--max_memory',
+                        required = False,
+                        type = float,
+                        help = 'Memory ceiling in GB for depth tables',
+                        default = 16)
+    parser.add_argument('--export_depth',
+                        nargs = '+',
+                        required = False,
+                        type = str,
+                        help = 'Export binary depth stores (.ccd) to full depth tsv files in the result directory and exit')
+    parser.add_argument('--index_cache',
+                        required = False,
+                        type = str,
+                        help = 'Directory for reusable minimap2 indexes of padded references (off unless given, e.g. ~/.cache/circulocov)',
+                        default = None)
+    parser.add_argument('--index_cache_size',
+                        required = False,
+                        type = float,
+                        help = 'Maximum size of the minimap2 index cache in GB, used with --index_cache (0 turns the cache off)',
+                        default = 10)
+    parser.add_argument('--resume',
+                        action = argparse.BooleanOptionalAction,
+                        help = 'Skip stages that finished in an earlier run into the same result directory with the same inputs',
+                        default = False)
+    parser.add_argument('--add',
+                        action = argparse.BooleanOptionalAction,
+                        help = 'Add the given reads to an existing result directory, keeping the platforms already there without mapping them again',
+                        default = False)
     parser.add_argument('-o', '--out',
                         required = False,
                         type = str,
@@ -101,6 +179,33 @@ def main():
                         version = version)
     args = parser.parse_args()
 
+    if args.export_depth:
+        from circulocov.utils.depth_store import export_depth_store # pylint: disable=C0415
+
+        logging.basicConfig(format='%(asctime)s - %(message)s',
+            datefmt = '%y-%b-%d %H:%M:%S',
+            level=args.loglevel.upper())
+
+        os.makedirs(args.out, exist_ok=True)
+        for store in args.export_depth:
+            export_depth_store(store, args.out)
+        sys.exit(0)
+
+    if not args.genome and not args.samplesheet:
+        parser.error('the following arguments are required: -g/--genome')
+
+    if any(windows < 1 for windows in args.pyramid):
+        parser.error('--pyramid window numbers must be positive')
+
+    if args.subsample_depth is not None and args.subsample_fraction is not None:
+        parser.error('--subsample_depth and --subsample_fraction cannot be used together')
+
+    if args.subsample_depth is not None and args.subsample_depth <= 0:
+        parser.error('--subsample_depth must be positive')
+
+    if args.subsample_fraction is not None and not 0 < args.subsample_fraction <= 1:
+        parser.error('--subsample_fraction must be between 0 and 1')
+
     logging.basicConfig(format='%(asctime)s - %(message)s',
         datefmt = '%y-%b-%d %H:%M:%S',
         level=args.loglevel.upper())
@@ -113,152 +218,49 @@ def main():
         logging.fatal(e)
         sys.exit(1)
 
+    if args.depth_format in ['parquet', 'feather']:
+        try:
+            import pyarrow # pylint: disable=C0415,W0611
+        except ImportError:
+            logging.fatal(f'pyarrow is needed to write {args.depth_format} files!')
+            sys.exit(1)
+
     # printing everything to the screen
-    logging.info(f'Filename prefix :\t{args.sample}')
     logging.info(f'CirculoCov ver :\t{str(version)}')
     logging.info(f'minimap2 ver :\t{str(minimap2_ver)}')
     logging.info(f'Final directory :\t{str(args.out)}')
     logging.info(f'Num threads :\t{str(args.threads)}')
     logging.info(f'Padding length :\t{str(args.padding)}')
+    if args.lift:
+        logging.info('Lift is set :\tWill move alignments off the padding of circular contigs')
+    if args.subsample_depth is not None:
+        logging.info(f'Subsample depth :\t{str(args.subsample_depth)}')
+    if args.subsample_fraction is not None:
+        logging.info(f'Subsample fraction :\t{str(args.subsample_fraction)}')
+    if args.min_mapq or args.include_flags or args.exclude_flags is not None or args.min_length:
+        logging.info(f'Read filters :\tmin MAPQ {args.min_mapq}, include flags {args.include_flags}, exclude flags {args.exclude_flags}, min length {args.min_length}')
+    if args.add:
+        logging.info('Add is set :\tWill keep platforms already in the result directory')
+    if args.resume:
+        logging.info('Resume is set :\tWill skip stages that already finished')
+    if args.index_cache and args.index_cache_size > 0:
+        logging.info(f'Index cache :\t{str(args.index_cache)}')
     if args.all:
         logging.info('All is set :\tWill create windows and graph coverages')
         logging.info(f'Window number :\t{str(args.window)}')
-    logging.info(f'Genome file :\t{str(args.genome)}')
-    if args.nanopore:
-        logging.info(f'Nanopore file :\t{str(args.nanopore)}')
-    if args.illumina:
-        logging.info(f"Illumina file(s) :\t{', '.join(args.illumina)}")
-    if args.pacbio:
-        logging.info(f'PacBio file :\t{str(args.pacbio)}')
-
-    if not args.nanopore and not args.illumina and not args.pacbio:
-        logging.fatal('Cannot run without fastq files!')
-        sys.exit(1)
-
-    if not os.path.exists(args.out):
-        os.mkdir(args.out)
-
-    if not os.path.exists(args.out + '/fastq') and args.all :
-        os.mkdir(args.out + '/fastq')
-
-    with tempfile.TemporaryDirectory(dir = args.out) as temp_dir:
-
-        ##### ----- ----- ----- ----- ----- #####
-        ##### Part 1. Setup                 #####
-        ##### ----- ----- ----- ----- ----- #####
-        
-        logging.info('Setting up genome file')
-        genome_dict, fasta, total_length = genome_prep(args, temp_dir)
-
-        ##### ----- ----- ----- ----- ----- #####
-        ##### Part 2. Minimap2              #####
-        ##### ----- ----- ----- ----- ----- #####
-
-        logging.info('Mapping reads to reference')
-
-        if args.nanopore:
-            logging.info('Mapping nanopore reads to reference')
-            nanopore_bam = mapping(args.nanopore, fasta, 'map-ont', args, temp_dir)
-        else:
-            nanopore_bam = ''
-
-        if args.illumina:
-            logging.info('Mapping illumina reads to reference')
-            illumina_bam = mapping(args.illumina, fasta, 'sr', args, temp_dir)
-        else:
-            illumina_bam = ''
-
-        if args.pacbio:
-            logging.info('Mapping pacbio reads to reference')
-            pacbio_bam   = mapping(args.pacbio, fasta, 'map-pb', args, temp_dir)
-        else:
-            pacbio_bam   = ''
-
-        ##### ----- ----- ----- ----- ----- #####
-        ##### Part 3. Samtools Counts       #####
-        ##### ----- ----- ----- ----- ----- #####
-
-        logging.info('Getting coverage and depth')
-
-        df_depth = pd.DataFrame(columns = ['contig', 'pos'])
-        df_cov   = pd.DataFrame(columns = ['#rname', 'startpos', 'endpos'])
-
-        if os.path.exists(nanopore_bam):
-            logging.info('Getting coverage and depth for nanopore reads')
-            analysis_df_depth, analysis_df_cov = counts(nanopore_bam, genome_dict, 'nanopore', args, temp_dir)
-            df_cov   = merge_cov_dataframe(  df_cov,   analysis_df_cov,   'nanopore')
-            if args.all :
-                df_depth = merge_depth_dataframe(df_depth, analysis_df_depth, 'nanopore')
-
-        if os.path.exists(illumina_bam):
-            logging.info('Getting coverage and depth for illumina reads')
-            analysis_df_depth, analysis_df_cov = counts(illumina_bam, genome_dict, 'illumina', args, temp_dir)
-            df_cov   = merge_cov_dataframe(  df_cov,   analysis_df_cov,   'illumina')
-            if args.all:
-                df_depth = merge_depth_dataframe(df_depth, analysis_df_depth, 'illumina')
-
-        if os.path.exists(pacbio_bam):
-            logging.info('Getting coverage and depth for PacBio reads')
-            analysis_df_depth, analysis_df_cov = counts(pacbio_bam, genome_dict, 'pacbio', args, temp_dir)
-            df_cov   = merge_cov_dataframe(  df_cov,   analysis_df_cov,   'pacbio')
-            if args.all:
-                df_depth = merge_depth_dataframe(df_depth, analysis_df_depth, 'pacbio')
-        
-        df_depth = df_depth.infer_objects(copy=False).fillna(0)
-        df_depth = df_depth.sort_values(by=['contig', 'pos']).reset_index(drop=True)
-        df_depth.to_csv(args.out + '/depth.txt', index=False, sep = '\t')
-        
-        df_cov = df_cov.sort_values(by=['endpos'], ascending=[False]).reset_index(drop=True)
-        df_cov.to_csv(  args.out + '/cov.txt',   index=False, sep = '\t')
-
-        ##### ----- ----- ----- ----- ----- #####
-        ##### Part 4. Extract fastq         #####
-        ##### ----- ----- ----- ----- ----- #####
-                
-        logging.info('Extracting fastq files')
-
-        results_dict = {}
-        results_dict['total_length'] = total_length
-
-        if os.path.exists(nanopore_bam):
-            logging.info('Extracting nanopore fastq files')
-            results_dict['unmapped_nanopore'] = extract(nanopore_bam, genome_dict,
-                                                        'nanopore',
-                                                        args,
-                                                        temp_dir)
-
-        if os.path.exists(illumina_bam):
-            logging.info('Extracting illumina fastq files')
-            results_dict['unmapped_illumina'] = extract(illumina_bam, genome_dict,
-                                                        'illumina',
-                                                        args,
-                                                        temp_dir)
-
-        if os.path.exists(pacbio_bam):
-            logging.info('Extracting pacbio fastq files')
-            results_dict['unmapped_pacbio']   = extract(pacbio_bam,
-                                                        genome_dict,
-                                                        'pacbio',
-                                                        args,
-                                                        temp_dir)
-
-        ##### ----- ----- ----- ----- ----- #####
-        ##### Part 5. Graph Coverage        #####
-        ##### ----- ----- ----- ----- ----- #####
-
-        df_depth = pd.read_table(args.out + '/depth.txt')
+        logging.info(f"Pyramid windows :\t{', '.join(str(windows) for windows in args.pyramid)}")
+        logging.info(f'Depth format :\t{str(args.depth_format)}')
+        logging.info(f'Max memory :\t{str(args.max_memory)} GB')
 
-        if args.all:
-            logging.info('Graphing coverage')
+    if args.samplesheet:
+        from circulocov.utils.batch import batch # pylint: disable=C0415
 
-            visualize(genome_dict, df_depth, args)
+        logging.info(f'Sample sheet :\t{str(args.samplesheet)}')
+        batch(args)
+    else:
+        from circulocov.utils.pipeline import pipeline # pylint: disable=C0415
 
-        ##### ----- ----- ----- ----- ----- #####
-        ##### Part 6. Create Summary        #####
-        ##### ----- ----- ----- ----- ----- #####
-            
-        logging.info('Creating summary')
-        summary(df_cov, genome_dict, results_dict, args)
+        pipeline(args)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+''' Runs one sequencing platform through the pipeline '''
+
+import glob
+import logging
+import os
+import time
+
+from .index_cache import index_cache
+from .mapping     import mapping
+from .subsample   import subsample_fraction
+from .counts      import counts, count_files, read_counts
+from .extract     import extract
+from .writer      import flush, write_later
+from .checkpoint  import fingerprint, file_fingerprint, finished, record
+from .metrics     import stage, collect
+
+def analyze(reads, fasta, preset, analysis, genome_dict, args, temp_dir):
+    ''' Maps, counts and extracts the reads from one platform, returning the results and stage metrics '''
+
+    start = time.perf_counter()
+
+    result = None
+    with stage('platform', analysis, temp_dir):
+        # stages that finished in an earlier run with the same inputs are skipped with --resume
+        inputs = fingerprint(reads, fasta, preset, args)
+
+        mapped = finished(args, 'mapping', analysis, inputs)
+        if mapped:
+            bam, scale = mapped['result']['bam'], mapped['result']['scale']
+        else:
+            with stage('index'):
+                index = index_cache(fasta, preset, args)
+
+            # --lift moves alignments off the padding, so the bam has the original contig lengths
+            lengths = None
+            if args.lift:
+                lengths = {contig: genome_dict[contig]['length'] for contig in genome_dict if genome_dict[contig]['circ']}
+
+            # very deep read sets can be cut down to a fraction or a target depth before mapping
+            fraction = subsample_fraction([reads] if isinstance(reads, str) else reads,
+                                          sum(genome_dict[contig]['length'] for contig in genome_dict),
+                                          args)
+
+            logging.info(f'Mapping {analysis} reads to reference with {args.threads} threads')
+            with stage('mapping'):
+                bam, scale = mapping(reads, index, preset, args, temp_dir, lengths, fraction)
+
+            if os.path.exists(bam):
+                record(args, 'mapping', analysis, inputs, [bam, bam + '.bai'], {'bam': bam, 'scale': scale})
+
+        if os.path.exists(bam):
+            # stages after mapping are run again whenever the bam is remade
+            inputs['bam'] = file_fingerprint(bam)
+
+            if finished(args, 'counts', analysis, inputs):
+                df_depth, df_cov = read_counts(analysis, args)
+            else:
+                logging.info(f'Getting coverage and depth for {analysis} reads')
+                with stage('counts'):
+                    df_depth, df_cov = counts(bam, genome_dict, analysis, args)
+
+                # queued behind the tables, so it is only recorded once they are on disk
+                write_later(record, args, 'counts', analysis, inputs, count_files(analysis, args))
+
+            extracted = finished(args, 'extract', analysis, inputs)
+            if extracted:
+                num_unmapped = extracted['result']
+            else:
+                logging.info(f'Extracting {analysis} fastq files')
+                with stage('extract'):
+                    num_unmapped = extract(bam, genome_dict, analysis, args)
+
+                fastqs = glob.glob(args.out + '/fastq/' + args.sample + '_*_' + analysis + '*.fastq.gz') if args.all else []
+                record(args, 'extract', analysis, inputs, fastqs, num_unmapped)
+
+            # tables are handed back in memory, but the files have to exist before the process ends
+            with stage('write'):
+                flush()
+
+            result = (df_depth, df_cov, num_unmapped, scale)
+        else:
+            logging.warning(f'No bam file was created for {analysis} reads')
+
+    logging.info(f'Finished {analysis} reads in {time.perf_counter() - start:.1f} seconds')
+
+    return result, collect()
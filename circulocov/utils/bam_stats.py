@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+'''
+Gets coverage, read counts and per-base depth in one pass over a bam
+
+The numbers match samtools coverage, and are cached beside the bam in
+<bam>.stats.json (with the depth arrays in a depth store, <bam>.stats.ccd)
+so later stages and reruns do not read the alignments again.
+'''
+
+import json
+import logging
+import os
+from array import array
+import numpy as np
+import pandas as pd
+import pysam
+
+from .coverage import coverage, COV_DTYPES
+from .depth import block_depth
+from .depth_store import open_depth_store, add_depth, close_depth_store, read_header, read_depth
+from .lift import SPLIT_TAG
+from .read_filter import read_filter, only_flags, passes
+
+STATS_VERSION = 1
+
+# cigars longer than this are walked with numpy instead of python
+LONG_CIGAR = 32
+
+ALIGNED_OPS = np.array([pysam.CMATCH, pysam.CEQUAL, pysam.CDIFF])
+REF_OPS     = np.array([pysam.CMATCH, pysam.CDEL, pysam.CREF_SKIP, pysam.CEQUAL, pysam.CDIFF])
+QUERY_OPS   = np.array([pysam.CMATCH, pysam.CINS, pysam.CSOFT_CLIP, pysam.CEQUAL, pysam.CDIFF])
+
+def stats_key(bam, filters):
+    ''' Describes the bam and filters the cached numbers came from '''
+
+    bai = bam + '.bai'
+    return {'version': STATS_VERSION,
+            'bam':     [os.path.getsize(bam), os.path.getmtime(bam)],
+            'bai':     os.path.getmtime(bai) if os.path.exists(bai) else None,
+            'filters': filters}
+
+def read_stats(bam, filters, depth = False):
+    ''' Gets the cached numbers for a bam, if they were made from this bam with these filters '''
+
+    path = bam + '.stats.json'
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'r', encoding='utf-8') as handle:
+            cached = json.load(handle)
+    except json.JSONDecodeError:
+        return None
+
+    if cached['key'] != stats_key(bam, filters):
+        return None
+    if depth and not (cached['depth'] and os.path.exists(bam + '.stats.ccd')):
+        return None
+
+    logging.info(f'Using coverage and depth for {bam} from {path}')
+    return cached
+
+def write_stats(bam, filters, stats, depth):
+    ''' Caches the numbers beside the bam, writing the json last so a partial cache is never used '''
+
+    df_cov = stats['coverage']
+    cached = {'key':      stats_key(bam, filters),
+              'depth':    depth,
+              'unmapped': stats['unmapped'],
+              'paired':   stats['paired'],
+              'coverage': {column: df_cov[column].tolist() for column in df_cov.columns}}
+
+    tmp_path = bam + '.stats.json.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as handle:
+        json.dump(cached, handle)
+    os.replace(tmp_path, bam + '.stats.json')
+
+    logging.debug(f'Cached coverage and depth for {bam}')
+
+def coverage_table(rows):
+    ''' Turns the summed numbers of each contig into the columns samtools coverage prints '''
+
+    # samtools coverage prints %g and %.3g, so the same rounding is kept
+    table = []
+    for contig, length, numreads, covbases, summed_depth, summed_baseq, summed_mapq in rows:
+        table.append([contig,
+                      1,
+                      length,
+                      numreads,
+                      covbases,
+                      float(f'{100.0 * covbases / length:g}'),
+                      float(f'{summed_depth / length:g}'),
+                      float(f'{summed_baseq / summed_depth:.3g}') if summed_depth > 0 else 0.0,
+                      float(f'{summed_mapq / numreads:.3g}') if numreads > 0 else 0.0])
+
+    df = pd.DataFrame(table, columns = list(COV_DTYPES)).astype(COV_DTYPES)
+    df = df.sort_values(by=['endpos', '#rname'], ascending= [False, True], ignore_index=True)
+
+    return df
+
+def read_blocks(read, starts, ends):
+    ''' Adds the aligned blocks of a read and gets the summed quality of their bases like samtools pileup '''
+
+    quals = read.query_qualities
+    cigar = read.cigartuples
+    pos   = read.reference_start
+
+    # missing qualities are stored as 255, and alignments without a sequence (secondaries) add nothing
+    missing = 255 if read.query_length else 0
+
+    if len(cigar) <= LONG_CIGAR:
+        qpos   = 0
+        baseq  = 0
+        for op, length in cigar:
+            if op in (pysam.CMATCH, pysam.CEQUAL, pysam.CDIFF):
+                starts.append(pos)
+                ends.append(pos + length)
+                baseq += sum(quals[qpos:qpos + length]) if quals is not None else missing * length
+                pos   += length
+                qpos  += length
+            elif op in (pysam.CINS, pysam.CSOFT_CLIP):
+                qpos += length
+            elif op in (pysam.CDEL, pysam.CREF_SKIP):
+                pos += length
+        return baseq
+
+    # long nanopore cigars are walked all at once
+    ops, lengths = np.array(cigar, dtype = np.int64).T
+    aligned  = np.isin(ops, ALIGNED_OPS)
+    on_ref   = np.where(np.isin(ops, REF_OPS), lengths, 0)
+    on_query = np.where(np.isin(ops, QUERY_OPS), lengths, 0)
+    ref_pos   = pos + np.cumsum(on_ref) - on_ref
+    query_pos = np.cumsum(on_query) - on_query
+
+    starts.frombytes(ref_pos[aligned].tobytes())
+    ends.frombytes((ref_pos + lengths)[aligned].tobytes())
+
+    if quals is None:
+        return missing * int(lengths[aligned].sum())
+
+    summed = np.concatenate([[0], np.cumsum(np.frombuffer(quals, dtype = np.uint8), dtype = np.int64)])
+    return int((summed[query_pos + lengths][aligned] - summed[query_pos][aligned]).sum())
+
+def scan_bam(bam, threads, filters, stats):
+    ''' Yields the depth of one contig at a time while adding up its coverage numbers '''
+
+    exclude = filters['exclude']
+    simple  = only_flags(filters)
+
+    with pysam.AlignmentFile(bam, 'rb', threads = threads) as alignments:
+        references = alignments.references
+        lengths    = alignments.lengths
+
+        def finish(tid, starts, ends, numreads, summed_baseq, summed_mapq):
+            ''' Turns what was gathered for one contig into its depth and coverage row '''
+
+            contig_depth = block_depth(starts, ends, lengths[tid])
+            stats['rows'].append([references[tid],
+                                  lengths[tid],
+                                  numreads,
+                                  int(np.count_nonzero(contig_depth)),
+                                  int(contig_depth.sum(dtype = np.int64)),
+                                  summed_baseq,
+                                  summed_mapq])
+            return references[tid], contig_depth
+
+        tid      = 0
+        paired   = 0
+        starts   = array('q')
+        ends     = array('q')
+        numreads = summed_baseq = summed_mapq = 0
+
+        # the bam is sorted, so each contig is finished before the next one starts
+        for read in alignments.fetch(until_eof = True):
+            flag = read.flag
+            if flag & 0x1:
+                paired += 1
+
+            reference_id = read.reference_id
+            while tid < len(references) and (reference_id < 0 or reference_id > tid):
+                yield finish(tid, starts, ends, numreads, summed_baseq, summed_mapq)
+                tid      = tid + 1
+                starts   = array('q')
+                ends     = array('q')
+                numreads = summed_baseq = summed_mapq = 0
+
+            if reference_id < 0 or flag & exclude:
+                continue
+            if not simple and not passes(read, filters):
+                continue
+
+            # the piece --lift split off at the end of a circular contig adds depth, but its read was already counted
+            if not (flag & 0x800 and read.has_tag(SPLIT_TAG)):
+                numreads    += 1
+                summed_mapq += read.mapping_quality
+
+            # unmapped reads placed next to their mate have no cigar
+            cigar = read.cigartuples
+            if flag & 0x4 or not cigar:
+                continue
+
+            # most short reads align end to end, so they skip the cigar walk
+            quals = read.query_qualities
+            if len(cigar) == 1 and cigar[0][0] == pysam.CMATCH and quals is not None:
+                start = read.reference_start
+                starts.append(start)
+                ends.append(start + cigar[0][1])
+                summed_baseq += sum(quals)
+            else:
+                summed_baseq += read_blocks(read, starts, ends)
+
+        while tid < len(references):
+            yield finish(tid, starts, ends, numreads, summed_baseq, summed_mapq)
+            tid      = tid + 1
+            starts   = array('q')
+            ends     = array('q')
+            numreads = summed_baseq = summed_mapq = 0
+
+        stats['unmapped'] = alignments.unmapped
+        stats['paired']   = paired
+
+def bam_coverage(bam, args, filters = None):
+    ''' Gets the coverage table and read counts of a bam without its depth '''
+
+    filters = filters if filters else read_filter(args)
+
+    cached = read_stats(bam, filters)
+    if cached:
+        return {'unmapped': cached['unmapped'],
+                'paired':   cached['paired'],
+                'coverage': pd.DataFrame(cached['coverage']).astype(COV_DTYPES)}
+
+    # samtools coverage would count both pieces of alignments split at the end of a circular contig
+    if args.lift:
+        stats = {}
+        for _ in bam_stats(bam, args, filters, stats):
+            pass
+        return stats
+
+    # coverage alone is quicker to get from samtools
+    with pysam.AlignmentFile(bam, 'rb') as alignments:
+        stats = {'unmapped': alignments.unmapped,
+                 'paired':   None,
+                 'coverage': coverage(bam, filters)}
+    write_stats(bam, filters, stats, False)
+
+    return stats
+
+def bam_stats(bam, args, filters = None, stats = None):
+    ''' Yields the depth of each contig, leaving the coverage table and read counts in stats when done '''
+
+    filters = filters if filters else read_filter(args)
+    stats   = stats if stats is not None else {}
+
+    cached = read_stats(bam, filters, depth = True)
+    if cached:
+        stats['unmapped'] = cached['unmapped']
+        stats['paired']   = cached['paired']
+        stats['coverage'] = pd.DataFrame(cached['coverage']).astype(COV_DTYPES)
+
+        header = read_header(bam + '.stats.ccd')
+        for entry in header['arrays']:
+            contig_depth = read_depth(bam + '.stats.ccd', 'depth', entry['contig'], header = header)
+            yield entry['contig'], np.array(contig_depth, dtype = np.uint32)
+        return
+
+    logging.debug(f'Getting coverage and depth for {bam} in one pass')
+    stats['rows'] = []
+    store = open_depth_store(bam + '.stats.ccd')
+    for contig, contig_depth in scan_bam(bam, args.threads, filters, stats):
+        add_depth(store, 'depth', contig, contig_depth)
+        yield contig, contig_depth
+    close_depth_store(store)
+
+    stats['coverage'] = coverage_table(stats.pop('rows'))
+    write_stats(bam, filters, stats, True)
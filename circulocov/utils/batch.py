@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+''' Runs many samples from a sample sheet '''
+
+import concurrent.futures
+import copy
+import csv
+import logging
+import os
+import sys
+import pandas as pd
+
+from .pipeline      import pipeline
+from .thread_budget import share_threads
+
+def read_sample_sheet(sample_sheet):
+    ''' Reads a tsv of sample, genome, illumina, nanopore and pacbio '''
+
+    samples = []
+    with open(sample_sheet, 'r', encoding='utf-8') as sheet:
+        for row in csv.DictReader(sheet, delimiter='\t'):
+            row = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+
+            if not row.get('sample') or not row.get('genome'):
+                logging.fatal(f'Every row in {sample_sheet} needs a sample and a genome!')
+                sys.exit(1)
+
+            # paired illumina files can be separated by commas or spaces
+            illumina = row.get('illumina', '').replace(',', ' ').split()
+
+            sample = {'sample':   row['sample'],
+                      'genome':   row['genome'],
+                      'illumina': illumina if illumina else None,
+                      'nanopore': row.get('nanopore') or None,
+                      'pacbio':   row.get('pacbio') or None}
+
+            if not sample['illumina'] and not sample['nanopore'] and not sample['pacbio']:
+                logging.fatal(f"Cannot run {sample['sample']} without fastq files!")
+                sys.exit(1)
+
+            if sample['sample'] in [previous['sample'] for previous in samples]:
+                logging.fatal(f"Sample {sample['sample']} is listed more than once in {sample_sheet}!")
+                sys.exit(1)
+
+            samples.append(sample)
+
+    return samples
+
+def sample_summary(args):
+    ''' Runs one sample and hands back only its summary '''
+
+    return pipeline(args)[0]
+
+def batch(args):
+    ''' Runs every sample in the sample sheet and combines the summaries '''
+
+    samples = read_sample_sheet(args.samplesheet)
+    logging.info(f'There were {str(len(samples))} samples found in {args.samplesheet}')
+
+    if not os.path.exists(args.out):
+        os.mkdir(args.out)
+
+    # samples run in parallel with a share of the threads each
+    workers, shares = share_threads(args.threads, len(samples))
+    summaries = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        tasks = {}
+        for i, sample in enumerate(samples):
+            sample_args = copy.copy(args)
+            sample_args.sample   = sample['sample']
+            sample_args.genome   = sample['genome']
+            sample_args.illumina = sample['illumina']
+            sample_args.nanopore = sample['nanopore']
+            sample_args.pacbio   = sample['pacbio']
+            sample_args.out      = args.out + '/' + sample['sample']
+            sample_args.threads  = shares[i]
+            tasks[sample['sample']] = executor.submit(sample_summary, sample_args)
+
+        for sample, future in tasks.items():
+            summaries[sample] = future.result()
+            logging.info(f'Finished sample {sample}')
+
+    df = pd.concat(summaries.values(), ignore_index=True)
+
+    # samples without a platform leave gaps, so keep the counts as integers
+    for column in df.columns:
+        if column.endswith('_numreads') or column.endswith('_covbases'):
+            df[column] = df[column].astype('Int64')
+    df.to_csv(args.out + '/overall_summary.txt', index=False, sep = '\t')
+
+    return df
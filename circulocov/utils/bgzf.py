@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+'''
+Writes BGZF files, the blocked gzip samtools and htslib use
+
+Data is cut into blocks of at most BLOCK_SIZE bytes that are compressed on
+their own, so blocks can be compressed on several threads (zlib lets go of
+the GIL) and written in order. Every block is a gzip member, so gzip and
+zcat read the files too.
+'''
+
+import collections
+import struct
+import zlib
+
+# the largest block htslib writes, leaving room for incompressible data
+BLOCK_SIZE = 0xff00
+
+# gzip header with the BC extra field holding the block size
+HEADER = struct.Struct('<4BI2BH2BHH')
+
+# empty block that marks the end of a BGZF file
+EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+def compress_block(data, level = 1):
+    ''' Compresses up to BLOCK_SIZE bytes into one BGZF block '''
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata      = compressor.compress(data) + compressor.flush()
+
+    return (HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25)
+            + cdata
+            + struct.pack('<II', zlib.crc32(data), len(data)))
+
+def open_bgzf(path, executor = None):
+    ''' Opens a BGZF file, compressing its blocks on the executor's threads when given '''
+
+    return {'path':     path,
+            'handle':   open(path, 'wb'), # pylint: disable=R1732
+            'buffer':   bytearray(),
+            'pending':  collections.deque(),
+            'executor': executor}
+
+def write_blocks(bgzf, wait = False):
+    ''' Writes compressed blocks in order, waiting for all of them when asked '''
+
+    pending = bgzf['pending']
+    while pending and (wait or pending[0].done() or len(pending) > 64):
+        bgzf['handle'].write(pending.popleft().result())
+
+def write_bgzf(bgzf, data):
+    ''' Adds data to a BGZF file '''
+
+    buffer = bgzf['buffer']
+    buffer += data
+    if len(buffer) < BLOCK_SIZE:
+        return
+
+    for start in range(0, len(buffer) - BLOCK_SIZE + 1, BLOCK_SIZE):
+        block = bytes(buffer[start:start + BLOCK_SIZE])
+        if bgzf['executor'] is None:
+            bgzf['handle'].write(compress_block(block))
+        else:
+            bgzf['pending'].append(bgzf['executor'].submit(compress_block, block))
+    del buffer[:len(buffer) // BLOCK_SIZE * BLOCK_SIZE]
+
+    write_blocks(bgzf)
+
+def close_bgzf(bgzf, eof = True):
+    ''' Writes what is left and closes the file, leaving off the end marker for pieces that are joined later '''
+
+    if bgzf['buffer']:
+        if bgzf['executor'] is None:
+            bgzf['handle'].write(compress_block(bytes(bgzf['buffer'])))
+        else:
+            bgzf['pending'].append(bgzf['executor'].submit(compress_block, bytes(bgzf['buffer'])))
+    write_blocks(bgzf, wait = True)
+
+    if eof:
+        bgzf['handle'].write(EOF_BLOCK)
+    bgzf['handle'].close()
+
+    return bgzf['path']
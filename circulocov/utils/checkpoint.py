@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+''' Records finished stages so a rerun can skip them '''
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+
+MANIFEST = 'manifest.json'
+
+# the inputs each stage depends on, so changing the window does not redo the mapping
+STAGE_INPUTS = {'mapping': ['genome', 'padding', 'preset', 'reads', 'lift', 'subsample'],
+                'counts':  ['bam', 'all', 'window', 'pyramid', 'depth_format', 'compress_store', 'filters'],
+                'extract': ['bam', 'all', 'filters']}
+
+def sha256(path):
+    ''' Hashes a file in chunks '''
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+def file_fingerprint(path):
+    ''' Describes a file by its size and modification time '''
+
+    if not os.path.exists(path):
+        return [os.path.abspath(path), None, None]
+
+    return [os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)]
+
+def fingerprint(reads, fasta, preset, args):
+    ''' Describes the inputs and settings that the stages of a platform depend on '''
+
+    reads = [reads] if isinstance(reads, str) else reads
+
+    # read files are large, so their size and modification time stand in for a hash
+    return {'genome':         sha256(fasta),
+            'padding':        args.padding,
+            'preset':         preset,
+            'reads':          [file_fingerprint(fastq) for fastq in reads],
+            'lift':           bool(args.lift),
+            'subsample':      [args.subsample_fraction, args.subsample_depth],
+            'all':            bool(args.all),
+            'window':         args.window,
+            'pyramid':        list(args.pyramid),
+            'filters':        [args.min_mapq, args.include_flags, args.exclude_flags, args.min_length],
+            'depth_format':   args.depth_format,
+            'compress_store': bool(args.compress_store)}
+
+def read_manifest(out):
+    ''' Reads the stages finished in earlier runs '''
+
+    manifest = out + '/' + MANIFEST
+    if not os.path.exists(manifest):
+        return {}
+
+    try:
+        with open(manifest, 'r', encoding='utf-8') as handle:
+            return json.load(handle)
+    except json.JSONDecodeError:
+        logging.warning(f'Could not read {manifest}, every stage will be run again')
+        return {}
+
+def finished(args, stage_name, analysis, inputs):
+    ''' Gets the manifest entry of a stage that already finished with the same inputs and intact files '''
+
+    if not args.resume:
+        return None
+
+    key    = args.sample + ' ' + analysis + ' ' + stage_name
+    inputs = {name: inputs[name] for name in STAGE_INPUTS[stage_name]}
+    entry  = read_manifest(args.out).get(key)
+    if not entry or entry['inputs'] != inputs:
+        return None
+
+    for path, size in entry['outputs'].items():
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            return None
+
+    logging.info(f'Skipping {key}, it finished in an earlier run')
+    return entry
+
+def record(args, stage_name, analysis, inputs, outputs, result = None):
+    ''' Adds a finished stage to the manifest '''
+
+    key    = args.sample + ' ' + analysis + ' ' + stage_name
+    inputs = {name: inputs[name] for name in STAGE_INPUTS[stage_name]}
+
+    # platforms run in parallel, so the result directory is locked while the manifest is rewritten
+    lock = os.open(args.out, os.O_RDONLY)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        manifest = read_manifest(args.out)
+        manifest[key] = {'inputs':  inputs,
+                         'outputs': {path: os.path.getsize(path) for path in outputs},
+                         'result':  result}
+
+        tmp_manifest = args.out + '/' + MANIFEST + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_manifest, 'w', encoding='utf-8') as handle:
+            json.dump(manifest, handle, indent=2)
+        os.replace(tmp_manifest, args.out + '/' + MANIFEST)
+    finally:
+        os.close(lock)
+
+    logging.debug(f'Recorded {key} in {args.out}/{MANIFEST}')
@@ -4,21 +4,27 @@
 
 ''' Gets coverage for sam '''
 
-import concurrent.futures
-import os
 import pandas as pd
 import logging
 
-from .coverage import coverage
-from .depth import depth
+from .coverage import COV_DTYPES
+from .bam_stats import bam_stats, bam_coverage
+from .depth import depth_dataframe
 from .create_dataframe import create_depth_dataframe
-
-def counts(bam, genome_dict, analysis, args, tmp):
+from .depth_pyramid import depth_pyramid
+from .depth_store import write_depth_store
+from .stream import stream_depth
+from .writer import write_table, write_later, table_path, read_table
+from .metrics import stage
+from .read_filter import read_filter
+
+def counts(bam, genome_dict, analysis, args):
     ''' Gets relevant counts '''
 
     logging.info(f'Getting coverage for {analysis}')
 
-    df_cov   = coverage(bam)
+    # the same filters are applied while counting coverage, depth and extracting reads
+    filters  = read_filter(args)
     cov_cols = ['#rname',
                 'startpos',
                 'endpos',
@@ -29,39 +35,75 @@ def counts(bam, genome_dict, analysis, args, tmp):
                 'meanbaseq',
                 'meanmapq']
 
-    df_cov.to_csv(args.out + '/' + analysis + '_cov.txt',
-                  columns=cov_cols,
-                  index=False,
-                  sep = '\t')
+    # coverage and depth come from one pass over the bam, or from the numbers cached beside it
+    stats = {}
 
-    if args.all:
+    if args.all and args.stream:
+        logging.info(f'Streaming depth for {analysis} one contig at a time')
+
+        with stage('depth'):
+            df_window_depth = stream_depth(bam_stats(bam, args, filters, stats), genome_dict, analysis, args)
+
+        write_table(df_window_depth.copy(), args.out + '/' + analysis + '_window_depth.txt', args.depth_format)
+
+    elif args.all:
         logging.info(f'Getting depth for {analysis}')
 
-        # run by contig to speed up processing
-        results = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers = args.threads) as executor:
-            tasks = []
-            for contig in genome_dict.keys():
-                future = executor.submit(depth, bam, contig, tmp)
-                tasks.append(future)
+        # one pass over the bam for every contig
+        with stage('depth'):
+            depths = dict(bam_stats(bam, args, filters, stats))
+
+        if args.depth_format == 'store':
+            write_later(write_depth_store,
+                        args.out + '/' + analysis + '_full_depth.ccd',
+                        {analysis: depths},
+                        args.compress_store)
+        else:
+            write_table(depth_dataframe(depths), args.out + '/' + analysis + '_full_depth.txt', args.depth_format)
+
+        with stage('windows'):
+            df_window_depth = create_depth_dataframe(depths, genome_dict, args)
+            df_pyramid      = depth_pyramid(depths, genome_dict, args)
+
+        write_table(df_pyramid, args.out + '/' + analysis + '_depth_pyramid.txt', args.depth_format)
+
+        write_table(df_window_depth.copy(), args.out + '/' + analysis + '_window_depth.txt', args.depth_format)
 
-            completed_tasks, _ = concurrent.futures.wait(tasks,return_when=concurrent.futures.ALL_COMPLETED)
-            results = [task.result() for task in completed_tasks]
+    else:
+        stats = bam_coverage(bam, args, filters)
+        df_window_depth = pd.DataFrame()
 
-        df_depth = pd.DataFrame(columns = ['contig', 'pos', 'depth'])
-        for dep_contig in results:
-            if os.stat(dep_contig).st_size > 0:
-                df_dep_contig = pd.read_table(dep_contig, names=['contig','pos', 'depth'])
-                df_depth = pd.concat([df_depth, df_dep_contig], ignore_index=True)
+    df_cov = stats['coverage']
+    write_table(df_cov.copy(),
+                args.out + '/' + analysis + '_cov.txt',
+                columns = cov_cols)
 
-        df_depth = df_depth.sort_values(['contig', 'pos']).reset_index(drop=True)
+    return df_window_depth, df_cov
 
-        df_depth.to_csv(args.out + '/' + analysis + '_full_depth.txt', index=False, sep = '\t')
+def count_files(analysis, args):
+    ''' Lists the files counts writes '''
 
-        df_window_depth = create_depth_dataframe(df_depth, genome_dict, args)
+    files = [args.out + '/' + analysis + '_cov.txt']
+
+    if args.all:
+        if args.depth_format == 'store':
+            files.append(args.out + '/' + analysis + '_full_depth.ccd')
+        else:
+            files.append(table_path(args.out + '/' + analysis + '_full_depth.txt', args.depth_format))
+        files.append(table_path(args.out + '/' + analysis + '_depth_pyramid.txt', args.depth_format))
+        files.append(table_path(args.out + '/' + analysis + '_window_depth.txt', args.depth_format))
 
-        df_window_depth.to_csv(args.out + '/' + analysis + '_window_depth.txt', index=False, sep = '\t')
+    return files
 
+def read_counts(analysis, args):
+    ''' Reads the coverage and window depth written by an earlier run '''
+
+    logging.info(f'Reading coverage and depth for {analysis} from an earlier run')
+
+    df_cov = pd.read_csv(args.out + '/' + analysis + '_cov.txt', sep='\t', dtype=COV_DTYPES)
+
+    if args.all:
+        df_window_depth = read_table(count_files(analysis, args)[-1], args.depth_format)
     else:
         df_window_depth = pd.DataFrame()
 
@@ -3,27 +3,43 @@
 
 ''' Gets coverage for bam '''
 
+import io
 import logging
 import pysam
 import pandas as pd
 
-def coverage(bam):
+from .metrics import stage
+from .read_filter import coverage_options
 
-    ''' Gets coverage for bam '''
+COV_DTYPES = {'#rname':    str,
+              'startpos':  'int64',
+              'endpos':    'int64',
+              'numreads':  'int64',
+              'covbases':  'int64',
+              'coverage':  'float64',
+              'meandepth': 'float64',
+              'meanbaseq': 'float64',
+              'meanmapq':  'float64'}
 
-    logging.debug(f'Getting coverage for {bam}')
-    covs = pysam.coverage(bam).split('\n')
+def parse_coverage(covs):
+    ''' Reads samtools coverage output into a dataframe '''
+
+    if not covs.strip():
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in COV_DTYPES.items()})
+
+    return pd.read_csv(io.StringIO(covs), sep='\t', dtype=COV_DTYPES)
 
-    header = covs[0].split('\t')
+def coverage(bam, filters = None):
 
-    df = pd.DataFrame(columns = header)
-    for cov in covs:
-        cov = cov.split('\t')
-        if '#rname' not in cov and len(cov) == len(header):
-            df.loc[len(df.index)] = cov
+    ''' Gets coverage for bam '''
+
+    options = coverage_options(filters) if filters else []
+
+    logging.debug(f'Getting coverage for {bam}')
+    with stage('samtools coverage'):
+        covs = pysam.coverage(*options, bam)
 
-    df['endpos']    = pd.to_numeric(df['endpos'], downcast='integer')
-    df['meandepth'] = pd.to_numeric(df['meandepth'])
+    df = parse_coverage(covs)
 
     df = df.sort_values(by=['endpos', '#rname'], ascending= [False, True], ignore_index=True)
 
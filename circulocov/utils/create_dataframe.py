@@ -2,45 +2,51 @@
 
 ''' Get dataframe of coverage '''
 
+import numpy as np
 import pandas as pd
 
-def create_depth_dataframe(df, genome_dict, args):
-    ''' Creating dataframe of coverages '''
+def fold(contig_depth, length):
+    ''' Adds the depth of the padded end back onto the beginning of the contig '''
+
+    contig_depth = contig_depth.astype(np.int64)
+
+    folded = contig_depth[:length].copy()
+    padded = contig_depth[length:]
+    folded[:len(padded)] += padded[:length]
 
-    df['contig'] = df['contig'].astype(str)
-    df['pos']    = pd.to_numeric(df['pos'],   downcast='integer')
-    df['depth']  = pd.to_numeric(df['depth'], downcast='integer')
+    return folded
 
-    df_window_depth = pd.DataFrame(columns = ['contig', 'pos', 'depth'])
+def create_depth_dataframe(depths, genome_dict, args):
+    ''' Creating dataframe of coverages '''
 
+    frames = []
     for contig in genome_dict.keys():
 
-        divisor = round(genome_dict[contig]['length'] / args.window)
+        length  = genome_dict[contig]['length']
+        divisor = round(length / args.window)
+
+        contig_depth = depths[contig]
+
+        # adding the padded coverage back onto the beginning of the contig
+        folded = fold(contig_depth, length)
 
-        # getting the 'divisor' points on the graph plus the near beginning and near end       
-        df_filtered = df[(df['contig'] == contig) & (df['pos'] <= genome_dict[contig]['length']) & ((df['pos'] % divisor == 0) | ( df['pos'] == 1 ) | ( df['pos'] == genome_dict[contig]['length'] - 1 ) )].copy()
-        if 1 not in df_filtered['pos'].values:
-            df_filtered.loc[len(df_filtered.index)] = [contig, 1, 0]  
-        if genome_dict[contig]['length'] - 1 not in df_filtered['pos'].values:
-            df_filtered.loc[len(df_filtered.index)] = [contig, genome_dict[contig]['length'] - 1, 0]
+        # getting the 'divisor' points on the graph plus the near beginning and near end
+        pos = np.arange(divisor, length + 1, divisor) if divisor > 0 else np.array([], dtype=np.int64)
+        pos = np.union1d(pos, [1, length - 1])
+        pos = pos[pos > 0]
 
-        # adding the padded coverage
-        df_filtered_padded = df[(df['contig'] == contig) & (df['pos'] > int(genome_dict[contig]['length']))].copy()
-        if not df_filtered_padded.empty :
-            df_filtered_padded['new_pos'] = df_filtered_padded['pos'] - int(genome_dict[contig]['length'])
-            df_filtered_padded = df_filtered_padded[(df_filtered_padded['new_pos'] % divisor == 0 ) | (df_filtered_padded['new_pos'] == 1 ) | (df_filtered_padded['new_pos'] == genome_dict[contig]['length'] - 1 ) ].copy()
-            df_filtered_padded = df_filtered_padded.drop(['pos', 'contig'], axis=1)
-            df_filtered_padded = df_filtered_padded.rename(columns={'depth': 'padded_depth', 'new_pos': 'pos'})
+        # samtools depth only reported covered bases, so uncovered points were never sampled
+        keep = (contig_depth[pos - 1] > 0) | (pos == 1) | (pos == length - 1)
+        pos  = pos[keep]
 
-            df_filtered = pd.merge(df_filtered, df_filtered_padded, left_on='pos', right_on='pos', how='left')
-            df_filtered = df_filtered.fillna(0)
-            df_filtered['new_depth'] = df_filtered['padded_depth'] + df_filtered['depth']
-            df_filtered = df_filtered.drop(['padded_depth', 'depth'], axis=1)
-            df_filtered = df_filtered.rename(columns={'new_depth': 'depth'})
-            df_filtered['depth']  = pd.to_numeric(df_filtered['depth'], downcast='integer')
+        frames.append(pd.DataFrame({'contig': str(contig),
+                                    'pos':    pos,
+                                    'depth':  folded[pos - 1]}))
 
-        df_window_depth = pd.concat([df_window_depth, df_filtered], ignore_index=True)
+    if not frames:
+        return pd.DataFrame(columns = ['contig', 'pos', 'depth'])
 
+    df_window_depth = pd.concat(frames, ignore_index=True)
     df_window_depth = df_window_depth.sort_values(['contig', 'pos']).reset_index(drop=True)
 
     return df_window_depth
@@ -2,15 +2,31 @@
 
 ''' Visualize coverage'''
 
+import matplotlib
 import pycirclize
 import pandas as pd
 import matplotlib.pyplot as plt
 
-def create_circos_figure(contig_dict, df, args):
-    ''' Visualize coverage for circular seqs '''
+# figures are only saved to files, never shown
+matplotlib.use('Agg')
 
-    df['pos'] = pd.to_numeric(df['pos'])
-    chr_df = df[df['contig'].astype(str) == contig_dict['name']].copy()
+# darker shades of the platform colors, for the lowest depth of each depth pyramid window
+DARK = {'illumina_min': '#997700', 'nanopore_min': '#004488', 'pacbio_min': '#994455'}
+
+def add_minimum(track, y, min_df, column):
+    ''' Draws the lowest depth of each depth pyramid window over a depth track '''
+
+    if min_df is None or column not in min_df.columns or y.max() <= 0:
+        return
+
+    # the track is scaled to the plotted depths, which windows between them can go above
+    lowest = min_df[column].to_numpy().clip(max = y.max())
+    track.line(min_df['pos'].to_numpy(), lowest, vmax = y.max(), color = DARK[column], lw = 0.5)
+
+def create_circos_figure(contig_dict, chr_df, args, min_df = None):
+    ''' Visualize coverage for circular seqs from the depths of that contig '''
+
+    chr_df['pos'] = pd.to_numeric(chr_df['pos'])
 
     if not chr_df.empty:
         circos = pycirclize.Circos(sectors={contig_dict['name']: contig_dict['length']})
@@ -28,35 +44,38 @@ def create_circos_figure(contig_dict, df, args):
             x = chr_df['pos'].to_numpy()
             i = 58
 
-            if 'nanopore_depth' in df.columns:
+            if 'nanopore_depth' in chr_df.columns:
                 y      = chr_df['nanopore_depth'].to_numpy()
                 track2 = sector.add_track((i, i + 10), r_pad_ratio=0.1)
                 track2.fill_between(x, y, color='#6699CC')
+                add_minimum(track2, y, min_df, 'nanopore_min')
                 track2.axis()
                 track2.grid()
                 i = i + 11
 
-            if 'illumina_depth' in df.columns:
+            if 'illumina_depth' in chr_df.columns:
                 y      = chr_df['illumina_depth'].to_numpy()
                 track3 = sector.add_track((i, i + 10), r_pad_ratio=0.1)
                 track3.fill_between(x, y, color='#EECC66')
+                add_minimum(track3, y, min_df, 'illumina_min')
                 track3.axis()
                 track3.grid()
                 i = i + 11
 
-            if 'pacbio_depth' in df.columns:
+            if 'pacbio_depth' in chr_df.columns:
                 y      = chr_df['pacbio_depth'].to_numpy()
                 track4 = sector.add_track((i, i + 10), r_pad_ratio=0.1)
                 track4.fill_between(x, y, color='#EE99AA')
+                add_minimum(track4, y, min_df, 'pacbio_min')
                 track4.axis()
                 track4.grid()
 
             if sector.name == circos.sectors[0].name:
-                if 'nanopore_depth' in df.columns:
+                if 'nanopore_depth' in chr_df.columns:
                     circos.text('nanopore', r=track2.r_center, deg = 10)
-                if 'illumina_depth' in df.columns:
+                if 'illumina_depth' in chr_df.columns:
                     circos.text('illumina', r=track3.r_center, deg = 10)
-                if 'pacbio_depth' in df.columns:
+                if 'pacbio_depth' in chr_df.columns:
                     circos.text('pacbio'  , r=track4.r_center, deg = 10)
 
             # Future plans : add line for average coverage
@@ -66,12 +85,11 @@ def create_circos_figure(contig_dict, df, args):
 
     return args.out + '/' + args.sample + '_' + contig_dict['name'] + '.png'
 
-def create_linear_figure(contig_dict, df, args):
+def create_linear_figure(contig_dict, chr_df, args, min_df = None):
 
-    ''' Visualize coverage for non-closed seqs '''
+    ''' Visualize coverage for non-closed seqs from the depths of that contig '''
 
-    df['pos'] = pd.to_numeric(df['pos'])
-    chr_df = df[df['contig'].astype(str) == contig_dict['name']]
+    chr_df['pos'] = pd.to_numeric(chr_df['pos'])
 
     if not chr_df.empty:
 
@@ -96,6 +114,15 @@ def create_linear_figure(contig_dict, df, args):
             #linestyles.append(':')
 
         cov_plot = chr_df.plot.line(x='pos', y=mean_depth_columns, color=colors)
+
+        # the lowest depth of each depth pyramid window, in the darker shade of each platform
+        if min_df is not None:
+            min_columns = [column.replace('_depth', '_min') for column in mean_depth_columns]
+            min_colors  = [DARK[column] for column in min_columns if column in min_df.columns]
+            min_columns = [column for column in min_columns if column in min_df.columns]
+            if min_columns:
+                min_df.plot.line(x='pos', y=min_columns, color=min_colors, ax=cov_plot, linestyle='--', linewidth=0.5)
+
         cov_plot.plot()
         plt.title(f"{args.sample} {contig_dict['name']} coverage")
         cov_plot.figure.savefig(f"{args.out}/{args.sample}_{contig_dict['name']}.png")
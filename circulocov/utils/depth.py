@@ -2,13 +2,30 @@
 
 ''' Gets depth for bam '''
 
-import pysam
+import numpy as np
+import pandas as pd
 
-def depth(bam, contig, tmp):
-    ''' Gets coverage for bam for contig '''
+def block_depth(starts, ends, length):
+    ''' Sums a +1 at every aligned block start and a -1 at every block end along the contig '''
 
-    depth_file = tmp + '/' + contig + '.txt'
+    events = np.bincount(np.frombuffer(starts, dtype=np.int64), minlength = length + 1)
+    events = events - np.bincount(np.frombuffer(ends, dtype=np.int64), minlength = length + 1)
 
-    pysam.depth(bam, '-r', contig, '-o', depth_file )
+    return np.cumsum(events[:length]).astype(np.uint32)
 
-    return depth_file
+def depth_dataframe(depths):
+    ''' Lists covered positions like samtools depth, sorted by contig and position '''
+
+    # positions within a contig are already in order, so sorting the contigs sorts the table
+    frames = []
+    for contig in sorted(depths):
+        contig_depth = depths[contig]
+        covered      = np.flatnonzero(contig_depth)
+        frames.append(pd.DataFrame({'contig': contig,
+                                    'pos':    covered + 1,
+                                    'depth':  contig_depth[covered]}))
+
+    if not frames:
+        return pd.DataFrame(columns = ['contig', 'pos', 'depth'])
+
+    return pd.concat(frames, ignore_index=True)
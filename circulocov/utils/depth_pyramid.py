@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+''' Get mean, min, max and median depth of every window at several resolutions '''
+
+import numpy as np
+import pandas as pd
+
+from .create_dataframe import fold
+
+PYRAMID_COLUMNS = ['contig', 'windows', 'start', 'end', 'mean', 'min', 'max', 'median']
+
+# short contigs get fewer windows instead of a row for every base
+MIN_WINDOW_SIZE = 10
+
+def window_stats(folded, windows):
+    ''' Summarizes the depth of a contig split into at most windows equal windows '''
+
+    length = len(folded)
+    size   = max(-(-length // windows), MIN_WINDOW_SIZE)
+    starts = np.arange(0, length, size)
+
+    # reduceat sums each window in one pass, the last window can be shorter
+    sums = np.add.reduceat(folded, starts)
+    ends = np.minimum(starts + size, length)
+
+    # medians of the full windows come from one reshaped view
+    full    = length // size
+    medians = np.empty(len(starts))
+    if full:
+        medians[:full] = np.median(folded[:full * size].reshape(full, size), axis=1)
+    if full < len(starts):
+        medians[full:] = np.median(folded[full * size:])
+
+    return {'windows': np.full(len(starts), windows),
+            'start':   starts + 1,
+            'end':     ends,
+            'mean':    (sums / (ends - starts)).round(2),
+            'min':     np.minimum.reduceat(folded, starts),
+            'max':     np.maximum.reduceat(folded, starts),
+            'median':  medians}
+
+def depth_pyramid(depths, genome_dict, args):
+    ''' Creating dataframe of window depths for every level in --pyramid '''
+
+    contigs = []
+    columns = {column: [] for column in PYRAMID_COLUMNS[1:]}
+    for contig in genome_dict.keys():
+        length = genome_dict[contig]['length']
+        if contig not in depths or length == 0:
+            continue
+
+        folded = fold(depths[contig], length)
+        for windows in args.pyramid:
+            stats = window_stats(folded, windows)
+            contigs.append((str(contig), len(stats['start'])))
+            for column, values in stats.items():
+                columns[column].append(values)
+
+    if not contigs:
+        return pd.DataFrame(columns = PYRAMID_COLUMNS)
+
+    # one table is built at the end, pandas is slow to make many small ones
+    df = pd.DataFrame({column: np.concatenate(values) for column, values in columns.items()})
+    df.insert(0, 'contig', np.repeat([contig for contig, _ in contigs], [count for _, count in contigs]))
+
+    return df
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+'''
+Compact per-base depth store
+
+The file starts with MAGIC and the offset and length of a json header. The
+header lists every platform and contig with the offset, dtype and length of
+its depth array. Arrays are stored as raw uint16/uint32 (so they can be
+memory-mapped) or as zlib-compressed chunks with their offsets listed in
+the header.
+'''
+
+import json
+import logging
+import struct
+import zlib
+import numpy as np
+
+from .depth import depth_dataframe
+
+MAGIC      = b'CCDEPTH1'
+PREAMBLE   = struct.Struct('<8sQQ')
+ALIGN      = 64
+CHUNK_SIZE = 1 << 20
+
+def align(offset):
+    ''' Rounds an offset up to the next aligned byte '''
+
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def open_depth_store(path, compress = False):
+    ''' Starts a depth store that arrays are added to one at a time '''
+
+    store = {'path':     path,
+             'handle':   open(path, 'wb'), # pylint: disable=R1732
+             'compress': compress,
+             'arrays':   []}
+
+    # the header goes at the end, so its offset is filled in last
+    store['handle'].write(PREAMBLE.pack(MAGIC, 0, 0))
+
+    return store
+
+def add_depth(store, platform, contig, contig_depth):
+    ''' Adds the depth array of one contig to an open depth store '''
+
+    handle = store['handle']
+    dtype  = np.uint16 if contig_depth.size == 0 or contig_depth.max() < 2 ** 16 else np.uint32
+    data   = np.ascontiguousarray(contig_depth, dtype = dtype)
+    entry  = {'platform': platform,
+              'contig':   contig,
+              'length':   int(data.size),
+              'dtype':    np.dtype(dtype).name}
+
+    if store['compress']:
+        entry['chunks'] = []
+        for start in range(0, data.size, CHUNK_SIZE):
+            blob = zlib.compress(data[start:start + CHUNK_SIZE].tobytes(), 1)
+            entry['chunks'].append([handle.tell(), len(blob)])
+            handle.write(blob)
+    else:
+        handle.seek(align(handle.tell()))
+        entry['offset'] = handle.tell()
+        data.tofile(handle)
+
+    store['arrays'].append(entry)
+
+def close_depth_store(store):
+    ''' Writes the header and closes the depth store '''
+
+    handle = store['handle']
+    header = json.dumps({'version':    1,
+                         'chunk_size': CHUNK_SIZE,
+                         'compressed': store['compress'],
+                         'arrays':     store['arrays']}).encode()
+    header_offset = handle.tell()
+    handle.write(header)
+
+    handle.seek(0)
+    handle.write(PREAMBLE.pack(MAGIC, header_offset, len(header)))
+    handle.close()
+
+    logging.debug(f"Depth store {store['path']} written")
+    return store['path']
+
+def write_depth_store(path, depths, compress = False):
+    ''' Writes {platform: {contig: depth array}} to a depth store '''
+
+    store = open_depth_store(path, compress)
+    for platform, contigs in depths.items():
+        for contig, contig_depth in contigs.items():
+            add_depth(store, platform, contig, contig_depth)
+
+    return close_depth_store(store)
+
+def read_header(path):
+    ''' Reads the header of a depth store '''
+
+    with open(path, 'rb') as store:
+        magic, header_offset, header_length = PREAMBLE.unpack(store.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a CirculoCov depth store')
+
+        store.seek(header_offset)
+        header = json.loads(store.read(header_length))
+
+    header['index'] = {(entry['platform'], entry['contig']): entry for entry in header['arrays']}
+    return header
+
+def read_depth(path, platform, contig, start = 0, end = None, header = None):
+    ''' Gets the depth of one contig (0-based, end exclusive) without loading the rest '''
+
+    header = header if header else read_header(path)
+    if (platform, contig) not in header['index']:
+        raise KeyError(f'{platform} {contig} is not in {path}')
+    entry = header['index'][(platform, contig)]
+
+    dtype = np.dtype(entry['dtype'])
+    end   = entry['length'] if end is None else min(end, entry['length'])
+
+    if start >= end:
+        return np.zeros(0, dtype = dtype)
+
+    if not header['compressed']:
+        depth = np.memmap(path,
+                          dtype  = dtype,
+                          mode   = 'r',
+                          offset = entry['offset'],
+                          shape  = (entry['length'],))
+        return depth[start:end]
+
+    # only the chunks that overlap the region are decompressed
+    chunk_size = header['chunk_size']
+    first      = start // chunk_size
+    last       = (end - 1) // chunk_size
+    pieces     = []
+    with open(path, 'rb') as store:
+        for chunk_offset, chunk_length in entry['chunks'][first:last + 1]:
+            store.seek(chunk_offset)
+            pieces.append(np.frombuffer(zlib.decompress(store.read(chunk_length)), dtype = dtype))
+
+    depth = np.concatenate(pieces)
+    return depth[start - first * chunk_size:end - first * chunk_size]
+
+def export_depth_store(path, out):
+    ''' Writes the <platform>_full_depth.txt tables of a depth store '''
+
+    header = read_header(path)
+    files  = []
+    for platform in dict.fromkeys(entry['platform'] for entry in header['arrays']):
+        depths = {entry['contig']: read_depth(path, platform, entry['contig'], header = header)
+                  for entry in header['arrays'] if entry['platform'] == platform}
+
+        files.append(out + '/' + platform + '_full_depth.txt')
+        depth_dataframe(depths).to_csv(files[-1], index=False, sep = '\t')
+
+        logging.info(f'Exported {platform} depth from {path} to {files[-1]}')
+
+    return files
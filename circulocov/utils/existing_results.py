@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+''' Reads back platforms from an earlier run into the same result directory '''
+
+import logging
+import os
+import sys
+import pysam
+
+from .checkpoint import read_manifest, sha256
+from .counts import count_files, read_counts
+
+# every platform CirculoCov maps, in the order they are merged
+PLATFORMS = {'nanopore': 'map-ont', 'illumina': 'sr', 'pacbio': 'map-pb'}
+
+def existing_results(platforms, fasta, args):
+    ''' Gets the coverage, window depth and unmapped reads of platforms that are not being mapped again '''
+
+    manifest = read_manifest(args.out)
+    genome   = sha256(fasta)
+    given    = [analysis for analysis, _, _ in platforms]
+    results  = {}
+
+    for analysis, preset in PLATFORMS.items():
+        if analysis in given or not os.path.exists(args.out + '/' + analysis + '_cov.txt'):
+            continue
+
+        key    = args.sample + ' ' + analysis + ' '
+        mapped = manifest.get(key + 'mapping')
+        if mapped and mapped['inputs']['genome'] != genome:
+            logging.fatal(f'The {analysis} results in {args.out} were made with a different genome or padding!')
+            sys.exit(1)
+
+        # lifted and padded coverage cannot be merged
+        if mapped and mapped['inputs'].get('lift', False) != bool(args.lift):
+            logging.fatal(f"The {analysis} results in {args.out} were made {'without' if args.lift else 'with'} --lift!")
+            sys.exit(1)
+
+        missing = [path for path in count_files(analysis, args) if not os.path.exists(path)]
+        if missing:
+            logging.fatal(f"Cannot add to {args.out}, {', '.join(missing)} not found. Is --all set the same as before?")
+            sys.exit(1)
+
+        df_depth, df_cov = read_counts(analysis, args)
+
+        extracted = manifest.get(key + 'extract')
+        bam       = args.out + '/' + args.sample + '.' + preset + '.bam'
+        if extracted:
+            num_unmapped = extracted['result']
+        elif os.path.exists(bam):
+            with pysam.AlignmentFile(bam, 'rb') as alignments:
+                num_unmapped = alignments.unmapped
+        else:
+            logging.fatal(f'Cannot find the number of unmapped {analysis} reads without {bam}!')
+            sys.exit(1)
+
+        # runs from before subsampling recorded only the bam
+        scale = 1.0
+        if mapped and isinstance(mapped['result'], dict):
+            scale = mapped['result']['scale']
+
+        logging.info(f'Keeping {analysis} results from {args.out}')
+        results[analysis] = (df_depth, df_cov, num_unmapped, scale)
+
+    return results
@@ -1,74 +1,247 @@
 #!/usr/bin/env python
 # pylint: disable=logging-fstring-interpolation
+# pylint: disable=R0912
+# pylint: disable=R0915
 
 ''' Extract reads for each contig '''
 
+import concurrent.futures
 import logging
+import multiprocessing
+import os
+import shutil
 import pysam
 
-def extract(bam, genome_dict, analysis, args, temp_dir):
+from .bgzf import open_bgzf, write_bgzf, close_bgzf, EOF_BLOCK
+from .read_filter import read_filter, only_flags, passes
+from .thread_budget import task_threads, bgzf_threads
+
+# reads samtools fastq leaves out by default : SECONDARY, SUPPLEMENTARY
+SKIP_FLAGS = 0x100 | 0x800
+
+# base qualities to their fastq characters, and bases (with IUPAC codes, like samtools) to their complement
+PHRED      = bytes((quality + 33) % 256 for quality in range(256))
+COMPLEMENT = bytes.maketrans(b'ACGTMRWSYKVHDBNacgtmrwsykvhdbn', b'TGCAKYWSRMBDHVNtgcakywsrmbdhvn')
+
+# a task holds contigs with about this share of the reads, so workers finish close together
+TASK_SHARE = 4
+
+def fastq_record(read):
+    ''' Formats a read in its original orientation like samtools fastq '''
+
+    seq   = read.query_sequence.encode()
+    quals = read.query_qualities
+    qual  = bytes(quals).translate(PHRED) if quals is not None else b'"' * len(seq)
+
+    if read.flag & 0x10:
+        seq  = seq.translate(COMPLEMENT)[::-1]
+        qual = qual[::-1]
+
+    return b'@' + read.query_name.encode() + b'\n' + seq + b'\n+\n' + qual + b'\n'
+
+def worker_logging(level):
+    ''' Sets up logging in an extraction process the way the command line does '''
+
+    logging.basicConfig(format='%(asctime)s - %(message)s',
+        datefmt = '%y-%b-%d %H:%M:%S',
+        level=level)
+
+def fastq_base(group, analysis, args):
+    ''' Names the fastq files of a contig or of the unmapped reads '''
+
+    return args.out + '/fastq/' + args.sample + '_' + group + '_' + analysis
+
+def plan_extraction(bam, threads):
+    ''' Splits the contigs into tasks, largest first, with the threads each one gets '''
+
+    with pysam.AlignmentFile(bam, 'rb') as alignments:
+        units = [(tid, stats.contig, stats.total) for tid, stats in enumerate(alignments.get_index_statistics())]
+        # reads without a position come last in the bam and are a unit of their own
+        units.append((len(units), None, alignments.nocoordinate))
+
+    total   = max(sum(reads for _, _, reads in units), 1)
+    workers = max(min(threads, len(units)), 1)
+    target  = total / (workers * TASK_SHARE)
+
+    tasks = []
+    task  = []
+    for unit in sorted(units, key = lambda unit: unit[2], reverse = True):
+        task.append(unit)
+        if sum(reads for _, _, reads in task) >= target:
+            tasks.append(task)
+            task = []
+    if task:
+        tasks.append(task)
+
+    # contigs with more than a worker's share of the reads get more threads to read and compress with,
+    # and tasks are started largest first so the ones running at once never hold more than threads
+    tasks  = sorted(tasks, key = lambda task: sum(reads for _, _, reads in task), reverse = True)
+    shares = task_threads([sum(reads for _, _, reads in task) for task in tasks], threads, workers)
+    plan   = [(sorted(task), share) for task, share in zip(tasks, shares)]
+
+    return plan, workers
+
+def extract_units(bam, units, paired, analysis, args, threads):
+    ''' Writes the fastq files of some contigs, putting unmapped reads in pieces that are joined later '''
+
+    filters = read_filter(args)
+    filters['exclude'] = args.exclude_flags & ~0x4 if args.exclude_flags is not None else 0
+    simple  = only_flags(filters) and not filters['exclude']
+
+    read_threads, compress_threads = bgzf_threads(threads)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = compress_threads) if compress_threads else None
+    result   = {'unmapped': 0, 'paired': 0, 'files': [], 'pieces': []}
+
+    def write(files, unit, group, suffix, record, leftover = False):
+        ''' Writes a record to the fastq file of a contig, or to the unit's piece of an unmapped file '''
+
+        path = fastq_base(group, analysis, args) + suffix
+        if group == 'unmapped':
+            path = f"{path}.{unit:06d}.{'leftover' if leftover else 'piece'}"
+
+        if path not in files:
+            files[path] = open_bgzf(path, executor)
+        write_bgzf(files[path], record)
+
+    # one unit is a contig, or the unmapped reads, and is read and written in one go
+    with pysam.AlignmentFile(bam, 'rb', threads = max(read_threads, 1)) as alignments:
+        for unit, contig, _ in units:
+            files   = {}
+            pending = {}
+
+            reads = alignments.fetch(contig) if contig is not None else alignments.fetch('*')
+            for read in reads:
+                if read.is_paired:
+                    result['paired'] += 1
+
+                if read.is_unmapped:
+                    result['unmapped'] += 1
+                    group = 'unmapped'
+                else:
+                    group = read.reference_name
+
+                if read.flag & SKIP_FLAGS:
+                    continue
+
+                if not simple and not read.is_unmapped and not passes(read, filters):
+                    continue
+
+                # records stored without their bases have nothing to write
+                if read.query_sequence is None:
+                    continue
+
+                record = fastq_record(read)
+
+                if not paired:
+                    write(files, unit, group, '.fastq.gz', record)
+                    continue
+
+                # mates that end up in different files are singletons right away
+                if read.mate_is_unmapped:
+                    mate_group = 'unmapped'
+                else:
+                    mate_group = read.next_reference_name
+
+                if not read.is_paired or not (read.is_read1 or read.is_read2) or mate_group != group:
+                    write(files, unit, group, '_singletons.fastq.gz', record)
+                    continue
+
+                mate = pending.pop((group, read.query_name), None)
+                if mate is None:
+                    pending[(group, read.query_name)] = (read.is_read1, record)
+                    continue
+
+                read1, read2 = (mate[1], record) if mate[0] else (record, mate[1])
+                write(files, unit, group, '_R1.fastq.gz', read1)
+                write(files, unit, group, '_R2.fastq.gz', read2)
+
+            # mates that never showed up
+            for (group, _), (_, record) in pending.items():
+                write(files, unit, group, '_singletons.fastq.gz', record, leftover = True)
+
+            for path, bgzf in files.items():
+                if path.endswith('.fastq.gz'):
+                    result['files'].append(close_bgzf(bgzf))
+                else:
+                    result['pieces'].append(close_bgzf(bgzf, eof = False))
+
+    if executor is not None:
+        executor.shutdown()
+
+    return result
+
+def join_pieces(pieces):
+    ''' Joins the pieces of the unmapped fastq files in the order the reads are in the bam '''
+
+    joined = {}
+    for piece in pieces:
+        path, unit, kind = piece.rsplit('.', 2)
+        joined.setdefault(path, []).append((kind == 'leftover', int(unit), piece))
+
+    for path, parts in joined.items():
+        with open(path, 'wb') as fastq:
+            for _, _, piece in sorted(parts):
+                with open(piece, 'rb') as handle:
+                    shutil.copyfileobj(handle, fastq)
+                os.remove(piece)
+            fastq.write(EOF_BLOCK)
+
+    return list(joined)
+
+def extract(bam, genome_dict, analysis, args):
     ''' Extract reads for each contig '''
 
-    if args.all :
-        # Checking if single end or paired end
-        single_check = int(pysam.view('-c', '-f',  '1', bam))
-
-        # NOTE : pysam sort has it's own multithreading, so don't use concurrent
-        for contig in genome_dict.keys():
-            logging.debug(f'Extracting reads for {contig} from {analysis} bam file')
-
-            # bam file names
-            out_bam    = temp_dir + '/' + args.sample + '_' + contig + '_' + analysis + '.bam'
-            sorted_bam = temp_dir + '/' + args.sample + '_' + contig + '_' + analysis + '.bam'
-
-            # fastq file names
-            fastq_base  = args.out + '/fastq/' + args.sample + '_' + contig + '_' + analysis
-
-            # getting mapped reads for region
-            pysam.view('-b', '-F', '4', bam, '-o', out_bam, contig, catch_stdout=False)
-            pysam.sort('-o', sorted_bam, '-@', str(args.threads), out_bam, catch_stdout=False)
-            pysam.index(sorted_bam)
-            if single_check == 0 :
-                pysam.fastq('-@',
-                            str(args.threads),
-                            sorted_bam,
-                            '-0',
-                            fastq_base + '.fastq.gz',
-                            catch_stdout=False)
-            else:
-                pysam.fastq('-@',
-                            str(args.threads),
-                            sorted_bam,
-                            '-1', fastq_base + '_R1.fastq.gz',
-                            '-2', fastq_base + '_R2.fastq.gz',
-                            '-s', fastq_base + '_singletons.fastq.gz', 
-                            catch_stdout=False)
-
-        # get unmapped reads as well
-        logging.debug(f'Extracting unmapped reads from {analysis} bam file')
-        unmapped_bam        = temp_dir + '/' + args.sample + '_unmapped_' + analysis + '.bam'
-        sorted_unmapped_bam = temp_dir + '/' + args.sample + '_unmapped_' + analysis + '.bam'
-        unmapped_base       = args.out + '/fastq/' + args.sample + '_unmapped_' + analysis
-
-        pysam.view('-b', '-f', '4', bam, '-o', unmapped_bam, catch_stdout=False)
-        pysam.sort('-o', sorted_unmapped_bam, '-@', str(args.threads), unmapped_bam, catch_stdout=False)
-        pysam.index(sorted_unmapped_bam)
-        if single_check == 0 :
-            pysam.fastq('-@',
-                        str(args.threads),
-                        sorted_unmapped_bam,
-                        '-0', unmapped_base + '.fastq.gz',
-                        catch_stdout=False)
-        else:
-            pysam.fastq('-@',
-                        str(args.threads),
-                        sorted_unmapped_bam,
-                        '-1', unmapped_base + '_R1.fastq.gz',
-                        '-2', unmapped_base + '_R2.fastq.gz',
-                        '-s', unmapped_base + '_singletons.fastq.gz',
-                        catch_stdout=False)
-
-    num_unmapped = int(pysam.view('-c', '-f',  '4', bam))
+    if not args.all :
+        # the bam index already knows how many reads are unmapped
+        with pysam.AlignmentFile(bam, 'rb') as alignments:
+            num_unmapped = alignments.unmapped
+
+        logging.info(f'There are {str(num_unmapped)} unmapped {analysis} reads.')
+        return num_unmapped
+
+    logging.debug(f'Extracting reads for every contig from {analysis} bam file')
+
+    # Checking if single end or paired end
+    with pysam.AlignmentFile(bam, 'rb') as alignments:
+        first  = next(alignments.fetch(until_eof = True), None)
+        paired = first is not None and first.is_paired
+
+    # samtools fastq keeps duplicates and qc failures, so only flags asked for with --exclude_flags
+    # are skipped, and unmapped reads always go to the unmapped files. Contigs are independent,
+    # so they are written by several processes at once.
+    plan, workers = plan_extraction(bam, args.threads)
+    logging.debug(f'Extracting {analysis} reads in {len(plan)} tasks on {workers} processes')
+
+    if workers == 1:
+        results = [extract_units(bam, units, paired, analysis, args, threads) for units, threads in plan]
+    else:
+        # tables are still being written on a background thread, and a forked process could start with its locks held,
+        # so the processes start from a fresh interpreter instead
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers,
+                                                    mp_context = multiprocessing.get_context('forkserver'),
+                                                    initializer = worker_logging,
+                                                    initargs = (logging.getLogger().getEffectiveLevel(),)) as executor:
+            tasks   = [executor.submit(extract_units, bam, units, paired, analysis, args, threads) for units, threads in plan]
+            results = [task.result() for task in tasks]
+
+    written = set(join_pieces([piece for result in results for piece in result['pieces']]))
+    for result in results:
+        written.update(result['files'])
+
+    # every contig gets its files, even without reads
+    suffixes = ['_R1.fastq.gz', '_R2.fastq.gz', '_singletons.fastq.gz'] if paired else ['.fastq.gz']
+    for group in list(genome_dict.keys()) + ['unmapped']:
+        for suffix in suffixes:
+            fastq = fastq_base(group, analysis, args) + suffix
+            if fastq not in written:
+                with open(fastq, 'wb') as empty:
+                    empty.write(EOF_BLOCK)
+
+    num_unmapped = sum(result['unmapped'] for result in results)
+    num_paired   = sum(result['paired'] for result in results)
+
+    logging.info(f'There are {str(num_paired)} paired {analysis} reads.')
     logging.info(f'There are {str(num_unmapped)} unmapped {analysis} reads.')
 
     return num_unmapped
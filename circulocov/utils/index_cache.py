@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+''' Keeps minimap2 indexes of padded references between runs '''
+
+import contextlib
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import subprocess
+
+@contextlib.contextmanager
+def cache_lock(cache_dir):
+    ''' Locks the cache directory, so samples run in parallel do not remove an index another one is picking up '''
+
+    lock = os.open(cache_dir, os.O_RDONLY)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(lock)
+
+def index_size(index):
+    ''' Gets the size and last use of an index, or None when another run removed it '''
+
+    try:
+        return os.path.getmtime(index), os.path.getsize(index)
+    except FileNotFoundError:
+        return None
+
+def evict(cache_dir, max_size, keep):
+    ''' Removes the least recently used indexes until the cache fits '''
+
+    with cache_lock(cache_dir):
+        sizes   = {index: index_size(index) for index in glob.glob(cache_dir + '/*.mmi')}
+        indexes = sorted((stat, index) for index, stat in sizes.items() if stat is not None)
+        total   = sum(size for (_, size), _ in indexes)
+
+        for (_, size), index in indexes:
+            if total <= max_size:
+                break
+            if index == keep:
+                continue
+
+            logging.debug(f'Removing {index} from the index cache')
+            total = total - size
+            try:
+                os.remove(index)
+            except FileNotFoundError:
+                pass
+
+def index_cache(fasta, preset, args):
+    ''' Gets a minimap2 index for the padded reference, building it only once '''
+
+    # indexes are only kept when asked for, since they can take gigabytes of a shared home directory
+    if not args.index_cache or args.index_cache_size <= 0:
+        return fasta
+
+    # the prepped fasta already holds the padded sequences and their names
+    sha = hashlib.sha256()
+    with open(fasta, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            sha.update(chunk)
+    sha.update(f'padding={args.padding}'.encode())
+
+    index = args.index_cache + '/' + sha.hexdigest() + '.' + preset + '.mmi'
+
+    os.makedirs(args.index_cache, exist_ok=True)
+
+    # marks the index as recently used, under the lock so it is not removed in between
+    with cache_lock(args.index_cache):
+        if os.path.exists(index):
+            logging.info(f'Using cached minimap2 index {index}')
+            os.utime(index)
+            return index
+
+    logging.info(f'Building minimap2 index {index}')
+    tmp_index = index + '.' + str(os.getpid()) + '.tmp'
+    command   = ['minimap2',
+                 '-x',
+                 preset,
+                 '-t',
+                 str(args.threads),
+                 '-d',
+                 tmp_index,
+                 fasta]
+    process = subprocess.run(command, capture_output=True, text=True, check=False)
+
+    if process.returncode != 0:
+        logging.warning(f'Could not build minimap2 index for {fasta}, mapping to the fasta instead')
+        logging.debug(process.stderr)
+        if os.path.exists(tmp_index):
+            os.remove(tmp_index)
+        return fasta
+
+    # another run may have built the same index in the meantime
+    os.replace(tmp_index, index)
+
+    evict(args.index_cache, args.index_cache_size * 1024 ** 3, index)
+
+    return index
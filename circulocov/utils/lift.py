@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+''' Moves alignments on padded circular contigs back onto the original coordinates '''
+
+import logging
+import math
+import pysam
+
+# cigar operations that move along the reference or the read
+REF_OPS   = {pysam.CMATCH, pysam.CDEL, pysam.CREF_SKIP, pysam.CEQUAL, pysam.CDIFF}
+QUERY_OPS = {pysam.CMATCH, pysam.CINS, pysam.CSOFT_CLIP, pysam.CEQUAL, pysam.CDIFF}
+
+# marks the piece split off an alignment at the end of a circular contig, so the read is only counted once
+SPLIT_TAG = 'ZC'
+
+# presets minimap2 runs without secondary alignments, which are only asked for to find the padded copy of a hit
+PRIMARY_ONLY = {'sr'}
+
+# lowest chaining score minimap2 keeps (-m) for each preset, which caps the mapping quality of a hit with no second best
+MIN_CHAIN_SCORE = {'sr': 25, 'map-ont': 40, 'map-pb': 40}
+
+def split_cigar(cigar, cut):
+    ''' Splits a cigar where it reaches cut bases along the reference '''
+
+    left, right = [], []
+    ref_pos = 0
+    for op, length in cigar:
+        if op not in REF_OPS:
+            (left if ref_pos < cut else right).append((op, length))
+        elif ref_pos + length <= cut:
+            left.append((op, length))
+        elif ref_pos >= cut:
+            right.append((op, length))
+        else:
+            left.append((op, cut - ref_pos))
+            right.append((op, ref_pos + length - cut))
+
+        if op in REF_OPS:
+            ref_pos += length
+
+    return left, right
+
+def clip(cigar, clipped, at_end):
+    ''' Soft clips the bases that went to the other piece, returning the cigar and the bases skipped on the reference '''
+
+    cigar = cigar if at_end else cigar[::-1]
+    hard  = []
+    if clipped and clipped[-1 if at_end else 0][0] == pysam.CHARD_CLIP:
+        hard = [clipped[-1 if at_end else 0]]
+    soft = sum(length for op, length in clipped if op in QUERY_OPS)
+
+    # the piece has to start and end on an aligned base
+    skipped = 0
+    while cigar and cigar[-1][0] not in {pysam.CMATCH, pysam.CEQUAL, pysam.CDIFF, pysam.CHARD_CLIP}:
+        op, length = cigar.pop()
+        if op in QUERY_OPS:
+            soft += length
+        elif op in REF_OPS:
+            skipped += length
+
+    cigar = cigar + [(pysam.CSOFT_CLIP, soft)] * bool(soft) + hard
+
+    return (cigar if at_end else cigar[::-1]), skipped
+
+def split_read(read, length):
+    ''' Splits an alignment that runs over the end of a circular contig into two pieces '''
+
+    left, right = split_cigar(read.cigartuples, length - read.reference_start)
+    end_piece, _         = clip(left, right, True)
+    start_piece, skipped = clip(right, left, False)
+
+    first  = pysam.AlignedSegment.from_dict(read.to_dict(), read.header)
+    second = pysam.AlignedSegment.from_dict(read.to_dict(), read.header)
+    first.cigartuples  = end_piece
+    second.cigartuples = start_piece
+    second.reference_start = skipped
+
+    # edit distances and chimeric alignments were worked out for the whole alignment, and the template now runs over the end
+    for piece in (first, second):
+        piece.set_tag('NM', None)
+        piece.set_tag('SA', None)
+        piece.template_length = 0
+
+    # the piece with fewer aligned bases becomes a supplementary alignment
+    if first.query_alignment_length < second.query_alignment_length:
+        first, second = second, first
+    second.flag = second.flag | 0x800
+    second.set_tag(SPLIT_TAG, 1)
+
+    return [first, second]
+
+def lift_supplementary(tag, lengths):
+    ''' Moves the chimeric alignments in an SA tag that start in the padding back to the start of their contigs '''
+
+    entries = []
+    for entry in tag.rstrip(';').split(';'):
+        fields = entry.split(',')
+        if fields[0] in lengths and int(fields[1]) > lengths[fields[0]]:
+            fields[1] = str(int(fields[1]) - lengths[fields[0]])
+        entries.append(','.join(fields))
+
+    return ';'.join(entries) + ';'
+
+def lift_read(read, lengths):
+    ''' Moves one alignment onto the original coordinates of its contig '''
+
+    mate_moved = False
+    if read.is_paired and not read.mate_is_unmapped and read.next_reference_name in lengths:
+        if read.next_reference_start >= lengths[read.next_reference_name]:
+            read.next_reference_start -= lengths[read.next_reference_name]
+            mate_moved = True
+
+    if read.has_tag('SA'):
+        read.set_tag('SA', lift_supplementary(read.get_tag('SA'), lengths))
+
+    if read.is_unmapped or read.reference_name not in lengths:
+        return [read]
+
+    # a template with only one mate moved now runs over the end of the contig
+    length = lengths[read.reference_name]
+    moved  = read.reference_start >= length
+    if moved != mate_moved:
+        read.template_length = 0
+
+    if moved:
+        read.reference_start -= length
+        return [read]
+
+    if read.reference_end <= length:
+        return [read]
+
+    return split_read(read, length)
+
+def mapping_quality(read, second, min_score):
+    ''' Estimates the mapping quality of a hit from its chaining scores and the score of the next best hit '''
+
+    # the chain-only formula of mm_set_mapq in minimap2, with hits scoring below min_score never reported.
+    # With -a, minimap2 also weighs in the alignment score and identity, which are not kept for the other hits,
+    # so this is close for long reads and a few points off either way for short reads
+    score  = read.get_tag('s1')
+    pen_s1 = 1.0 if score > 100 else 0.01 * score
+    pen_cm = min(1.0 if read.get_tag('cm') > 10 else 0.1 * read.get_tag('cm'), pen_s1)
+    sub    = max(second, min_score)
+    if score <= sub:
+        return 0
+
+    return min(int(pen_cm * 40 * (1 - sub / score) * math.log(score)), 60)
+
+def pair_quality(pair):
+    ''' Raises the estimated mapping quality of the worse mate of a proper pair towards the better one, like minimap2 does '''
+
+    best = max(read.mapping_quality for read in pair)
+    for read in pair:
+        if read.mapping_quality < best:
+            read.mapping_quality = int(0.2 * read.mapping_quality + 0.8 * best + 0.499)
+
+def lift(sam, lifted, lengths, preset):
+    ''' Reads minimap2 alignments, lifts them onto the original circular contigs and writes them on '''
+
+    try:
+        alignments = pysam.AlignmentFile(sam, 'r')
+    except (OSError, ValueError) as e:
+        # samtools sort is waiting on the other end, so it gets an empty file instead of hanging
+        logging.debug(f'Could not read alignments from {sam} : {e}')
+        with open(lifted, 'wb'):
+            pass
+        return
+
+    header = alignments.header.to_dict()
+    for sequence in header['SQ']:
+        sequence['LN'] = lengths.get(sequence['SN'], sequence['LN'])
+
+    num_dropped  = 0
+    num_split    = 0
+    num_restored = 0
+    min_score    = MIN_CHAIN_SCORE.get(preset, 40)
+
+    def write_group(group):
+        ''' Writes the alignments of one read, keeping one of each hit that landed in the same place '''
+        nonlocal num_dropped, num_restored
+
+        # primary alignments win over the same hit found again in the padded copy of the start of the contig
+        seen    = {}
+        doubled = set()
+        for i, piece in sorted(enumerate(group), key = lambda item: bool(item[1].flag & 0x900)):
+            key = i if piece.is_unmapped else (piece.flag & 0xD0, piece.reference_id, piece.reference_start, piece.cigarstring)
+            if key not in seen:
+                seen[key] = i
+            else:
+                doubled.add(seen[key])
+        num_dropped += len(group) - len(seen)
+        kept         = [group[i] for i in sorted(seen.values())]
+
+        # minimap2 gave hits in the padded copy a mapping quality of 0 for tying with themselves,
+        # so it is estimated again with the next best hit that is not the padded copy
+        restored = [group[i] for i in doubled if not group[i].is_secondary and group[i].has_tag('s1') and group[i].has_tag('cm')]
+        for piece in restored:
+            second = max((other.get_tag('s1') for other in kept if other.is_secondary and other.flag & 0xC0 == piece.flag & 0xC0 and other.has_tag('s1')), default = 0)
+            piece.set_tag('s2', second)
+            piece.mapping_quality = max(piece.mapping_quality, mapping_quality(piece, second, min_score))
+        num_restored += len(restored)
+
+        primaries = [piece for piece in kept if not piece.flag & 0x904]
+        if restored and len(primaries) == 2 and all(piece.is_proper_pair for piece in primaries):
+            pair_quality(primaries)
+
+        # the longer piece of a split mate can be the one at the start of the contig
+        for piece in kept:
+            mates = [mate for mate in primaries if mate.flag & 0xC0 != piece.flag & 0xC0]
+            if piece.is_paired and mates and (piece.next_reference_id, piece.next_reference_start) != (mates[0].reference_id, mates[0].reference_start):
+                piece.next_reference_id    = mates[0].reference_id
+                piece.next_reference_start = mates[0].reference_start
+                piece.template_length      = 0
+
+        for piece in kept:
+            if preset not in PRIMARY_ONLY or not piece.is_secondary:
+                output.write(piece)
+
+    with alignments, pysam.AlignmentFile(lifted, 'wbu', header = header) as output:
+        group = []
+        for read in alignments:
+            # minimap2 writes every alignment of a read together
+            if group and read.query_name != group[0].query_name:
+                write_group(group)
+                group = []
+
+            pieces = lift_read(read, lengths)
+            num_split += len(pieces) - 1
+            group.extend(pieces)
+
+        if group:
+            write_group(group)
+
+    logging.debug(f'Split {num_split} alignments at the end of circular contigs, dropped {num_dropped} duplicates and restored the mapping quality of {num_restored}')
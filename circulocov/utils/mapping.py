@@ -4,46 +4,134 @@
 ''' Mapping/Alignment of reads to assembly '''
 
 import logging
+import multiprocessing
 import subprocess
 import os
 import pysam
 
-def mapping(reads, assembly, preset, args, temp_dir):
-    ''' Minimap2 FTW '''
+from .metrics       import stage
+from .lift          import lift
+from .subsample     import subsample, subsample_scale
+from .thread_budget import mapping_threads
 
-    # naming sam file
-    sam = temp_dir + '/' + args.sample + '.' + preset + '.sam'
-    bam = args.out + '/' + args.sample + '.' + preset + '.bam'
+def make_fifo(path):
+    ''' Makes a named pipe, replacing one left by an earlier run '''
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.mkfifo(path)
+
+    return path
+
+def start_process(target, *args):
+    ''' Starts a process that runs next to minimap2 and samtools sort '''
+
+    process = multiprocessing.Process(target = target, args = args)
+    process.start()
+
+    return process
+
+def join_processes(processes, return_code):
+    ''' Waits for the processes next to minimap2, returning the first exit code that is not 0 '''
+
+    for process in processes:
+        # a process is left waiting on its pipe when minimap2 or samtools sort stops early
+        if return_code:
+            process.terminate()
+        process.join()
+        return_code = return_code or process.exitcode
+
+    return return_code
+
+def sort_alignments(sorted_input, bam, threads, prefix):
+    ''' Sorts alignments from a named pipe into a bam, returning False when samtools sort fails '''
+
+    logging.debug(f'Sorting alignments from {sorted_input}')
+    try:
+        with stage('samtools sort'):
+            pysam.sort('-o', bam,
+                       '-@', str(threads),
+                       '-T', prefix,
+                       sorted_input)
+    except pysam.SamtoolsError as e:
+        logging.debug(f'Error: samtools sort failed with {e}')
+        return False
+
+    return True
+
+def mapping(reads, assembly, preset, args, temp_dir, lengths = None, fraction = 1.0):
+    ''' Minimap2 FTW, returning the bam and the fraction of bases that were mapped '''
+
+    # naming fifo and bam file
+    prefix = temp_dir + '/' + args.sample + '.' + preset
+    log    = prefix + '.log'
+    bam    = args.out + '/' + args.sample + '.' + preset + '.bam'
 
     # convert reads to list
     reads = [reads] if isinstance(reads, str) else reads
 
+    # minimap2 writes into a named pipe that samtools sort reads from,
+    # so alignments are sorted as they stream in and no sam touches the disk
+    sam = make_fifo(prefix + '.sam')
+
+    # with lengths of circular contigs, alignments are lifted off the padding on their way to samtools sort
+    sorted_input = make_fifo(prefix + '.lifted.bam') if lengths is not None else sam
+
+    # with a fraction below 1, each read file is subsampled into a named pipe that minimap2 reads from
+    fifos = [make_fifo(prefix + '.' + str(i) + '.fastq') for i in range(len(reads))] if fraction < 1 else []
+
+    # minimap2, samtools sort and the lift and subsample processes all run at once on the threads of this platform
+    minimap2_threads, sort_threads = mapping_threads(args.threads, (lengths is not None) + len(fifos))
+
     logging.info(f'Starting alignment for {reads}')
     command     = ['minimap2',
                    '-ax',
                    preset,
                    '-t',
-                   str(args.threads),
-                   assembly] + reads + ['>', sam]
-    command_str = ' '.join(command)
-    process     = subprocess.Popen(command_str,
-                                   shell=True,
-                                   stdout=subprocess.PIPE,
-                                   stderr=subprocess.PIPE)
-    return_code = process.wait()
+                   str(minimap2_threads),
+                   '-o',
+                   sam,
+                   assembly] + (fifos if fifos else reads)
+
+    # lifting needs the hit in the padded copy of the start of a contig, so it comes after the preset that may turn secondary alignments off
+    if lengths is not None:
+        command.insert(3, '--secondary=yes')
+
+    # minimap2 runs for as long as samtools sort is reading from it
+    with open(log, 'w', encoding='utf-8') as stderr, stage('minimap2'), subprocess.Popen(command, stderr=stderr) as process:
+
+        # pysam holds the GIL, so lifting runs in its own process next to the sort,
+        # and paired files are read by minimap2 in turns, so each one is fed by its own process
+        helpers = [start_process(lift, sam, sorted_input, lengths, preset)] if lengths is not None else []
+        helpers = helpers + [start_process(subsample, fastq, fifo, fraction) for fastq, fifo in zip(reads, fifos)]
+
+        if not sort_alignments(sorted_input, bam, sort_threads, prefix):
+            process.kill()
+
+        return_code = join_processes(helpers, process.wait())
+
+    for fifo in {sam, sorted_input}:
+        os.remove(fifo)
+
+    scale = 1.0
+    if fifos:
+        # the counts are missing when a sampler was stopped, so the fraction asked for stands in
+        scale = subsample_scale(fifos) or fraction
+        for fifo in fifos:
+            os.remove(fifo)
 
     # Check if the command executed successfully
     if return_code == 0:
         logging.debug('Command executed successfully.')
     else:
         logging.debug(f'Error: Command returned non-zero exit code {return_code}.')
+        with open(log, 'r', encoding='utf-8') as stderr:
+            logging.debug(stderr.read())
 
-    if os.path.exists(sam):
-        logging.debug(f'Sorting and indexing {sam}')
-        # note: originally I kept the sam files and pysam threw some indexing errors
-        pysam.sort('-o', bam, '-@', str(args.threads), sam)
-        pysam.index(bam)
+    if os.path.exists(bam):
+        with stage('samtools index'):
+            pysam.index(bam)
 
         logging.info(f'Bam file {bam} created')
 
-    return bam
+    return bam, scale
@@ -9,28 +9,21 @@ import pandas as pd
 def merge_depth_dataframe(df, analysis_df, analysis):
     ''' Adds prefixes and removes unneeded columns after merging '''
 
-    def fill_contig_column(row):
-        if pd.isna(row['contig']):
-            return row[analysis + '_contig']
-        else:
-            return row['contig']
-
-    def fill_pos_column(row):
-        if pd.isna(row['pos']):
-            return row[analysis + '_pos']
-        else:
-            return row['pos']
-
-    analysis_df['merge'] = analysis_df['contig'].astype(str) + '_' + analysis_df['pos'].astype(str)
     analysis_df = analysis_df.add_prefix(analysis + '_')
+    analysis_df = analysis_df.rename(columns={analysis + '_contig': 'contig', analysis + '_pos': 'pos'})
 
     copy_df = df.copy()
-    copy_df['merge'] = copy_df['contig'].astype(str) + '_' + copy_df['pos'].astype(str)
 
-    full_df           = pd.merge(copy_df, analysis_df, left_on='merge', right_on= analysis + '_merge', how='outer')
-    full_df['contig'] = full_df.apply(fill_contig_column, axis=1)
-    full_df['pos']    = full_df.apply(fill_pos_column,    axis=1)
-    full_df           = full_df.drop(['merge', analysis + '_merge', analysis + '_contig', analysis + '_pos'], axis=1)
+    # both sides share one set of contig categories, so pandas merges on their integer codes instead of string keys
+    for frame in [copy_df, analysis_df]:
+        frame['contig'] = frame['contig'].astype(str)
+        frame['pos']    = frame['pos'].astype('int64')
+    contigs = pd.Index(copy_df['contig'].unique()).union(analysis_df['contig'].unique())
+    for frame in [copy_df, analysis_df]:
+        frame['contig'] = pd.Categorical(frame['contig'], categories = contigs)
+
+    full_df           = pd.merge(copy_df, analysis_df, on=['contig', 'pos'], how='outer')
+    full_df['contig'] = full_df['contig'].astype(object)
     full_df['pos']    = pd.to_numeric(full_df['pos'], downcast='integer')
 
     logging.info(f'Mean depths from {analysis} have been merged in')
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+''' Records time and resources used by each stage '''
+
+import contextlib
+import json
+import logging
+import os
+import resource
+import time
+
+# stages finished in this process and the stages still running
+METRICS = {'pid': None, 'stages': [], 'running': []}
+
+def disk_usage(directory):
+    ''' Bytes used by the files in a directory '''
+
+    total = 0
+    for root, _, files in os.walk(directory):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except FileNotFoundError:
+                pass
+
+    return total
+
+def rss():
+    ''' Resident memory of this process right now in kilobytes, None where /proc is missing '''
+
+    try:
+        with open('/proc/self/statm', 'r', encoding='utf-8') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+def current():
+    ''' Stage records of this process, forked processes start their own '''
+
+    if METRICS['pid'] != os.getpid():
+        METRICS['pid']     = os.getpid()
+        METRICS['stages']  = []
+        METRICS['running'] = []
+
+    return METRICS
+
+@contextlib.contextmanager
+def stage(name, platform = None, temp_dir = None):
+    ''' Records wall time, cpu time, memory and temp disk usage of a stage '''
+
+    metrics = current()
+
+    # nested stages belong to the same platform and temp directory as the stage around them
+    if metrics['running']:
+        platform = platform if platform else metrics['running'][-1]['platform']
+        temp_dir = temp_dir if temp_dir else metrics['running'][-1]['temp_dir']
+
+    metrics['running'].append({'platform': platform, 'temp_dir': temp_dir})
+
+    wall     = time.perf_counter()
+    cpu      = time.process_time()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start    = rss()
+
+    try:
+        yield
+    finally:
+        metrics['running'].pop()
+
+        finished = resource.getrusage(resource.RUSAGE_CHILDREN)
+        end      = rss()
+        record   = {'stage':               name,
+                    'platform':            platform,
+                    'wall_seconds':        round(time.perf_counter() - wall, 3),
+                    'cpu_seconds':         round(time.process_time() - cpu, 3),
+                    # subprocesses like minimap2 that finished during the stage
+                    'child_cpu_seconds':   round(max(finished.ru_utime + finished.ru_stime - children.ru_utime - children.ru_stime, 0), 3),
+                    # memory held when the stage started and ended, which is what the stage itself adds or frees
+                    'rss_start_mb':        round(start / 1024, 1) if start is not None else None,
+                    'rss_end_mb':          round(end / 1024, 1) if end is not None else None,
+                    # ru_maxrss is the peak over the whole life of the process (or of its largest child), in kilobytes on linux
+                    'process_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                    'child_peak_rss_mb':   round(finished.ru_maxrss / 1024, 1),
+                    'temp_disk_mb':        round(disk_usage(temp_dir) / 1e6, 1) if temp_dir else None}
+
+        metrics['stages'].append(record)
+        logging.debug(f"Stage {name} took {record['wall_seconds']} seconds")
+
+def collect():
+    ''' Hands over the stage records of this process '''
+
+    metrics = current()
+    stages, metrics['stages'] = metrics['stages'], []
+
+    return stages
+
+def write_metrics(path, stages, args, wall_seconds):
+    ''' Writes the stage records of a run to json '''
+
+    report = {'sample':       args.sample,
+              'threads':      args.threads,
+              'wall_seconds': round(wall_seconds, 3),
+              'stages':       stages}
+
+    with open(path, 'w', encoding='utf-8') as metrics_file:
+        json.dump(report, metrics_file, indent=2)
+
+    logging.info(f'Run metrics written to {path}')
+    return path
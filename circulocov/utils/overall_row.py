@@ -61,4 +61,14 @@ def overall_row(df_cov, results_dict, args):
                 df.loc[orig_len, analysis + '_' + header ] = results_dict['meandepth'][analysis + '_' + header] # pylint disable=C0301
                 df[analysis + '_' + header ] = df[analysis + '_' + header ].round(2)
 
+        extrapolate(df, analysis, results_dict.get('scale_' + analysis, 1.0))
+
     return df
+
+def extrapolate(df, analysis, scale):
+    ''' Adds the depth the full read set would have had next to the observed depth of subsampled reads '''
+
+    if analysis + '_meandepth' in df.columns and scale < 1:
+        position = df.columns.get_loc(analysis + '_meandepth') + 1
+        df.insert(position, analysis + '_subsample', round(scale, 4))
+        df.insert(position + 1, analysis + '_extrapolated_meandepth', (df[analysis + '_meandepth'] / scale).round(2))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=R0912
+# pylint: disable=R0915
+
+''' Runs every stage for one sample '''
+
+import concurrent.futures
+import copy
+import logging
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+
+from .genome_prep       import genome_prep
+from .analyze           import analyze
+from .merge_dataframe   import merge_cov_dataframe, merge_depth_dataframe
+from .summary           import summary
+from .visualize         import visualize
+from .writer            import write_table, flush
+from .stream            import ROW_BYTES
+from .metrics           import stage, collect, write_metrics
+from .existing_results  import existing_results, PLATFORMS
+from .thread_budget     import share_threads
+
+def pipeline(args):
+    ''' Get coverage for one genome and its reads '''
+
+    logging.info(f'Filename prefix :\t{args.sample}')
+    logging.info(f'Genome file :\t{str(args.genome)}')
+    if args.nanopore:
+        logging.info(f'Nanopore file :\t{str(args.nanopore)}')
+    if args.illumina:
+        logging.info(f"Illumina file(s) :\t{', '.join(args.illumina)}")
+    if args.pacbio:
+        logging.info(f'PacBio file :\t{str(args.pacbio)}')
+
+    if not args.nanopore and not args.illumina and not args.pacbio:
+        logging.fatal('Cannot run without fastq files!')
+        sys.exit(1)
+
+    if not os.path.exists(args.out):
+        os.mkdir(args.out)
+
+    if not os.path.exists(args.out + '/fastq') and args.all :
+        os.mkdir(args.out + '/fastq')
+
+    start  = time.perf_counter()
+    stages = []
+
+    with tempfile.TemporaryDirectory(dir = args.out) as temp_dir:
+
+        ##### ----- ----- ----- ----- ----- #####
+        ##### Part 1. Setup                 #####
+        ##### ----- ----- ----- ----- ----- #####
+        
+        logging.info('Setting up genome file')
+        with stage('genome_prep', temp_dir = temp_dir):
+            genome_dict, fasta, total_length = genome_prep(args, temp_dir)
+
+        ##### ----- ----- ----- ----- ----- #####
+        ##### Part 2. Map, count, extract   #####
+        ##### ----- ----- ----- ----- ----- #####
+
+        logging.info('Mapping reads to reference')
+
+        platforms = []
+        if args.nanopore:
+            platforms.append(('nanopore', args.nanopore, 'map-ont'))
+        if args.illumina:
+            platforms.append(('illumina', args.illumina, 'sr'))
+        if args.pacbio:
+            platforms.append(('pacbio',   args.pacbio,   'map-pb'))
+
+        # each platform runs in its own process with a share of the threads, which it splits again between
+        # everything it starts (see thread_budget), so the platforms together stay within -t
+        workers, shares = share_threads(args.threads, len(platforms))
+
+        # every platform holds a depth table with a row for each covered base
+        if args.all and args.stream is None and total_length * ROW_BYTES * workers > args.max_memory * 1e9:
+            logging.info(f'Depth tables for {total_length} bases would not fit in {args.max_memory} GB, streaming one contig at a time')
+            args.stream = True
+
+        results = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+            tasks = {}
+            for i, (analysis, reads, preset) in enumerate(platforms):
+                platform_args = copy.copy(args)
+                platform_args.threads = shares[i]
+                tasks[analysis] = executor.submit(analyze,
+                                                  reads,
+                                                  fasta,
+                                                  preset,
+                                                  analysis,
+                                                  genome_dict,
+                                                  platform_args,
+                                                  temp_dir)
+
+            # each platform process hands back the metrics of its own stages
+            stages.extend(collect())
+            for analysis, future in tasks.items():
+                results[analysis], platform_stages = future.result()
+                stages.extend(platform_stages)
+
+        # with --add, platforms already in the result directory are read back instead of mapped again
+        if args.add:
+            results.update(existing_results(platforms, fasta, args))
+
+        ##### ----- ----- ----- ----- ----- #####
+        ##### Part 3. Merge Counts          #####
+        ##### ----- ----- ----- ----- ----- #####
+
+        logging.info('Merging coverage and depth')
+
+        with stage('merge', temp_dir = temp_dir):
+            df_depth = pd.DataFrame(columns = ['contig', 'pos'])
+            df_cov   = pd.DataFrame(columns = ['#rname', 'startpos', 'endpos'])
+
+            results_dict = {}
+            results_dict['total_length'] = total_length
+
+            for analysis in PLATFORMS:
+                if results.get(analysis) is None:
+                    continue
+
+                analysis_df_depth, analysis_df_cov, num_unmapped, scale = results[analysis]
+                df_cov = merge_cov_dataframe(df_cov, analysis_df_cov, analysis)
+                if args.all:
+                    df_depth = merge_depth_dataframe(df_depth, analysis_df_depth, analysis)
+                results_dict['unmapped_' + analysis] = num_unmapped
+                results_dict['scale_' + analysis]    = scale
+
+            df_depth = df_depth.infer_objects(copy=False).fillna(0)
+            df_depth = df_depth.sort_values(by=['contig', 'pos']).reset_index(drop=True)
+            write_table(df_depth.copy(), args.out + '/depth.txt', args.depth_format)
+
+            df_cov = df_cov.sort_values(by=['endpos'], ascending=[False]).reset_index(drop=True)
+            write_table(df_cov.copy(),   args.out + '/cov.txt')
+
+        ##### ----- ----- ----- ----- ----- #####
+        ##### Part 4. Graph Coverage        #####
+        ##### ----- ----- ----- ----- ----- #####
+
+        if args.all:
+            logging.info('Graphing coverage')
+
+            # with --add, only contigs with reads from the new platforms get new figures
+            contigs = None
+            if args.add:
+                contigs = set()
+                for analysis, _, _ in platforms:
+                    if results[analysis] is not None:
+                        df_new = results[analysis][1]
+                        contigs.update(df_new.loc[df_new['numreads'] > 0, '#rname'])
+
+            with stage('visualize', temp_dir = temp_dir):
+                visualize(genome_dict, df_depth, args, contigs)
+
+        ##### ----- ----- ----- ----- ----- #####
+        ##### Part 5. Create Summary        #####
+        ##### ----- ----- ----- ----- ----- #####
+            
+        logging.info('Creating summary')
+        with stage('summary', temp_dir = temp_dir):
+            df_summary = summary(df_cov, genome_dict, results_dict, args)
+
+        with stage('write', temp_dir = temp_dir):
+            flush()
+
+    stages.extend(collect())
+    write_metrics(args.out + '/run_metrics.json', stages, args, time.perf_counter() - start)
+
+    return df_summary, df_cov, df_depth
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+''' Decides which alignments are counted '''
+
+# same reads samtools depth and samtools coverage skip by default : UNMAP, SECONDARY, QCFAIL, DUP
+EXCLUDE_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+
+def read_filter(args = None):
+    ''' Gets the flags, mapping quality and length an alignment needs to be counted '''
+
+    filters = {'exclude':    EXCLUDE_FLAGS,
+               'include':    0,
+               'min_mapq':   0,
+               'min_length': 0}
+
+    if args is not None:
+        if args.exclude_flags is not None:
+            filters['exclude'] = args.exclude_flags
+        filters['include']    = args.include_flags
+        filters['min_mapq']   = args.min_mapq
+        filters['min_length'] = args.min_length
+
+    return filters
+
+def only_flags(filters):
+    ''' Checks if the exclude flags are the only filter, so the rest can be skipped per read '''
+
+    return not filters['include'] and not filters['min_mapq'] and not filters['min_length']
+
+def passes(read, filters):
+    ''' Checks an alignment the way samtools coverage does '''
+
+    # like samtools coverage, any one of the include flags is enough
+    if read.flag & filters['exclude']:
+        return False
+    if filters['include'] and not read.flag & filters['include']:
+        return False
+    if read.mapping_quality < filters['min_mapq']:
+        return False
+
+    # the length samtools coverage uses comes from the cigar, soft clips included
+    if filters['min_length'] and read.infer_query_length() < filters['min_length']:
+        return False
+
+    return True
+
+def coverage_options(filters):
+    ''' Turns the filters into samtools coverage options, leaving out the defaults '''
+
+    options = []
+    if filters['exclude'] != EXCLUDE_FLAGS:
+        options += ['--ff', str(filters['exclude'])]
+    if filters['include']:
+        options += ['--rf', str(filters['include'])]
+    if filters['min_mapq']:
+        options += ['-q', str(filters['min_mapq'])]
+    if filters['min_length']:
+        options += ['-l', str(filters['min_length'])]
+
+    return options
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+''' Gets depth one contig at a time so memory depends on the largest contig '''
+
+import logging
+import pandas as pd
+
+from .depth import depth_dataframe
+from .create_dataframe import create_depth_dataframe
+from .depth_pyramid import depth_pyramid, PYRAMID_COLUMNS
+from .depth_store import open_depth_store, add_depth, close_depth_store
+from .writer import table_path
+
+# rough size of one row of a depth table held in pandas
+ROW_BYTES = 100
+
+def stream_rows(args):
+    ''' Number of depth table rows held in memory at once '''
+
+    return max(int(args.max_memory * 1e9 / ROW_BYTES), 1)
+
+def open_table(path, table_format, columns = None):
+    ''' Opens a depth table that chunks are appended to '''
+
+    columns = columns if columns else ['contig', 'pos', 'depth']
+
+    return {'path': path, 'format': table_format, 'columns': columns, 'writer': None, 'rows': 0}
+
+def add_rows(table, df):
+    ''' Appends a chunk of rows to an open depth table '''
+
+    if table['format'] in ['parquet', 'feather']:
+        import pyarrow as pa # pylint: disable=C0415
+        chunk = pa.Table.from_pandas(df, preserve_index=False)
+        if table['writer'] is None:
+            if table['format'] == 'parquet':
+                import pyarrow.parquet as pq # pylint: disable=C0415
+                table['writer'] = pq.ParquetWriter(table['path'], chunk.schema)
+            else:
+                import pyarrow.ipc as ipc # pylint: disable=C0415
+                table['writer'] = ipc.new_file(table['path'], chunk.schema)
+        table['writer'].write_table(chunk)
+    else:
+        df.to_csv(table['path'],
+                  index  = False,
+                  sep    = '\t',
+                  mode   = 'a' if table['rows'] else 'w',
+                  header = not table['rows'])
+
+    table['rows'] += len(df)
+
+def close_table(table):
+    ''' Closes a depth table, writing just the header if no rows were added '''
+
+    if table['writer'] is not None:
+        table['writer'].close()
+    elif not table['rows']:
+        empty = pd.DataFrame(columns = table['columns'])
+        if table['format'] == 'parquet':
+            empty.to_parquet(table['path'], index=False)
+        elif table['format'] == 'feather':
+            empty.to_feather(table['path'])
+        else:
+            empty.to_csv(table['path'], index=False, sep = '\t')
+
+    logging.debug(f"Finished writing {table['path']}")
+    return table['path']
+
+def stream_depth(contigs, genome_dict, analysis, args):
+    ''' Writes the full depth of each contig as it is counted and returns the window depth '''
+
+    rows    = stream_rows(args)
+    windows = []
+    pyramid = open_table(table_path(args.out + '/' + analysis + '_depth_pyramid.txt', args.depth_format),
+                         args.depth_format,
+                         PYRAMID_COLUMNS)
+
+    if args.depth_format == 'store':
+        store = open_depth_store(args.out + '/' + analysis + '_full_depth.ccd', args.compress_store)
+    else:
+        table = open_table(table_path(args.out + '/' + analysis + '_full_depth.txt', args.depth_format),
+                           args.depth_format)
+
+    for contig, contig_depth in contigs:
+        logging.debug(f'Streaming {analysis} depth for {contig}')
+
+        if args.depth_format == 'store':
+            add_depth(store, analysis, contig, contig_depth)
+        else:
+            # the table of covered bases is written in pieces that fit under --max_memory
+            for start in range(0, len(contig_depth), rows):
+                chunk = depth_dataframe({contig: contig_depth[start:start + rows]})
+                chunk['pos'] += start
+                if len(chunk):
+                    add_rows(table, chunk)
+
+        if contig in genome_dict:
+            windows.append(create_depth_dataframe({contig: contig_depth}, {contig: genome_dict[contig]}, args))
+
+            df_pyramid = depth_pyramid({contig: contig_depth}, {contig: genome_dict[contig]}, args)
+            if len(df_pyramid):
+                add_rows(pyramid, df_pyramid)
+
+    if args.depth_format == 'store':
+        close_depth_store(store)
+    else:
+        close_table(table)
+    close_table(pyramid)
+
+    if not windows:
+        return pd.DataFrame(columns = ['contig', 'pos', 'depth'])
+
+    df_window_depth = pd.concat(windows, ignore_index=True)
+    df_window_depth = df_window_depth.sort_values(['contig', 'pos']).reset_index(drop=True)
+
+    return df_window_depth
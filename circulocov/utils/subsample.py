@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+'''
+Subsamples reads on their way to minimap2
+
+Reads are kept by a hash of their name, so the same reads are kept every
+run and both mates of a pair are kept or dropped together without the two
+files being read in step. Kept reads are streamed into a named pipe that
+minimap2 reads from, so nothing is written to disk.
+'''
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import zlib
+
+from .metrics import stage
+
+# hashes are compared to the fraction of this range that is kept
+HASH_RANGE = 1 << 64
+
+# bytes read from the start of each read file to estimate how many bases it holds
+SAMPLE_BYTES = 4 << 20
+
+def open_fastq(path):
+    ''' Opens a fastq file, gzipped or not '''
+
+    with open(path, 'rb') as handle:
+        gzipped = handle.read(2) == b'\x1f\x8b'
+
+    return gzip.open(path, 'rb') if gzipped else open(path, 'rb') # pylint: disable=R1732
+
+def read_name(header):
+    ''' Gets the name both mates share from a fastq header line '''
+
+    fields = header[1:].split(maxsplit = 1)
+    name   = fields[0] if fields else b''
+    if name[-2:] in (b'/1', b'/2'):
+        name = name[:-2]
+
+    return name
+
+def keep(name, threshold):
+    ''' Decides from its name if a read is kept '''
+
+    return int.from_bytes(hashlib.blake2b(name, digest_size = 8).digest(), 'little') < threshold
+
+def head(path, size):
+    ''' Gets the first bytes of a fastq file uncompressed, and how many bytes of the file they took '''
+
+    with open(path, 'rb') as handle:
+        raw = handle.read(size)
+
+    if raw[:2] != b'\x1f\x8b':
+        return raw, len(raw)
+
+    # gzipped and bgzipped files are several gzip members back to back, and the last one read is cut short
+    data = []
+    used = 0
+    rest = raw
+    while rest[:2] == b'\x1f\x8b':
+        decompressor = zlib.decompressobj(31)
+        try:
+            data.append(decompressor.decompress(rest))
+        except zlib.error:
+            break
+        if not decompressor.eof:
+            used = len(raw)
+            break
+        rest = decompressor.unused_data
+        used = len(raw) - len(rest)
+
+    return b''.join(data), used
+
+def estimate_bases(reads):
+    ''' Estimates the bases in fastq files from their first few megabytes and their size '''
+
+    bases = 0
+    for fastq in reads:
+        data, used = head(fastq, SAMPLE_BYTES)
+        size       = os.path.getsize(fastq)
+
+        # only whole records are counted, and the rest of the file is taken to hold the same bases per byte
+        lines  = data.split(b'\n')
+        whole  = (len(lines) - 1) // 4 * 4
+        seq    = sum(len(line.rstrip()) for line in lines[1:whole:4])
+        length = sum(len(line) + 1 for line in lines[:whole])
+
+        if used >= size:
+            bases += seq
+        elif length:
+            bases += round(seq / length * len(data) * size / used)
+
+    return bases
+
+def subsample_fraction(reads, total_length, args):
+    ''' Gets the fraction of reads to keep from --subsample_fraction or --subsample_depth '''
+
+    if args.subsample_fraction is not None:
+        return args.subsample_fraction
+
+    if args.subsample_depth is None:
+        return 1.0
+
+    # the target is in sequenced bases, so the mapped depth comes out lower by the share of bases that do not align
+    with stage('estimate bases'):
+        bases = estimate_bases(reads)
+
+    fraction = min(args.subsample_depth * total_length / bases, 1.0) if bases else 1.0
+    logging.info(f'There are about {bases} bases in {reads} ({bases / total_length:.1f}X), keeping {fraction:.4f} of the reads')
+
+    return fraction
+
+def subsample(fastq, fifo, fraction):
+    ''' Writes the kept reads of a fastq file into a named pipe, with the counts in <fifo>.json '''
+
+    threshold = int(fraction * HASH_RANGE)
+    counts    = {'reads': 0, 'kept_reads': 0, 'bases': 0, 'kept_bases': 0}
+
+    try:
+        handle = open_fastq(fastq)
+    except OSError as e:
+        # minimap2 is waiting on the other end, so it gets an empty file instead of hanging
+        logging.debug(f'Could not read reads from {fastq} : {e}')
+        with open(fifo, 'wb'):
+            pass
+        return
+
+    with handle, open(fifo, 'wb') as output:
+        for header in handle:
+            seq   = next(handle, b'')
+            plus  = next(handle, b'')
+            qual  = next(handle, b'')
+            bases = len(seq.rstrip())
+
+            counts['reads'] += 1
+            counts['bases'] += bases
+            if keep(read_name(header), threshold):
+                counts['kept_reads'] += 1
+                counts['kept_bases'] += bases
+                output.write(header + seq + plus + qual)
+
+    with open(fifo + '.json', 'w', encoding='utf-8') as handle:
+        json.dump(counts, handle)
+
+def subsample_scale(fifos):
+    ''' Gets the fraction of bases that were kept, which depths are divided by to extrapolate '''
+
+    counts = {'reads': 0, 'kept_reads': 0, 'bases': 0, 'kept_bases': 0}
+    for fifo in fifos:
+        if not os.path.exists(fifo + '.json'):
+            return None
+        with open(fifo + '.json', 'r', encoding='utf-8') as handle:
+            for key, value in json.load(handle).items():
+                counts[key] += value
+        os.remove(fifo + '.json')
+
+    logging.info(f"Kept {counts['kept_reads']} of {counts['reads']} reads with {counts['kept_bases']} of {counts['bases']} bases")
+
+    return counts['kept_bases'] / counts['bases'] if counts['bases'] else 1.0
@@ -29,3 +29,5 @@ def summary(df_cov, genome_dict, results_dict, args):
     df = df.rename(columns={'#rname': 'contigs', 'endpos': 'length'})
 
     df.to_csv(args.out + '/overall_summary.txt', index=False, sep = '\t')
+
+    return df
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+'''
+Splits the threads from -t between everything that runs at the same time
+
+Every process, subprocess and thread pool takes its threads from here, so
+together they stay within the cores they were given.
+'''
+
+# threads samtools sort gets on top of the one reading alignments, for the temporary files and the final bam
+SORT_THREADS = 1
+
+def share_threads(threads, jobs):
+    ''' Gets how many jobs run at once and the threads of each, handing the leftover threads to the first ones '''
+
+    # with more jobs than threads, each runs on one thread and the rest wait for a free worker
+    workers = max(min(jobs, threads), 1)
+    shares  = [threads // workers + (i % workers < threads % workers) for i in range(jobs)]
+
+    return workers, shares
+
+def mapping_threads(threads, helpers = 0):
+    ''' Splits the threads of a platform between minimap2 and samtools sort, leaving one for each helper process '''
+
+    # samtools sort reads the named pipe on a thread of its own, and only gets more when there are cores to spare
+    sort_threads     = SORT_THREADS if threads - helpers > SORT_THREADS + 2 else 0
+    minimap2_threads = max(threads - helpers - sort_threads - 1, 1)
+
+    return minimap2_threads, sort_threads
+
+def task_threads(sizes, threads, workers):
+    ''' Gives tasks, largest first, threads in proportion to their size while any workers tasks running at once stay within threads '''
+
+    # shares never grow down the list, so the first workers tasks hold the most threads any running tasks can
+    total  = max(sum(sizes), 1)
+    shares = []
+    for i, size in enumerate(sizes):
+        share = max(round(threads * size / total), 1)
+        if i < workers:
+            share = min(share, threads - sum(shares) - (workers - i - 1))
+        if shares:
+            share = min(share, shares[-1])
+        shares.append(max(share, 1))
+
+    return shares
+
+def bgzf_threads(threads):
+    ''' Splits the threads of an extraction task between reading the bam and compressing fastq blocks, keeping one for python '''
+
+    # deflating takes several times longer than inflating, and htslib only starts its own threads for two or more
+    read_threads     = (threads - 1) // 3 if (threads - 1) // 3 > 1 else 0
+    compress_threads = threads - 1 - read_threads
+
+    return read_threads, compress_threads
@@ -1,32 +1,114 @@
 #!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
 
 ''' visualize top 10 contigs '''
 
 import concurrent.futures
 import logging
+import os
+import numpy as np
+import pandas as pd
 
 from .top_ten import top_ten
-from .create_figure import create_circos_figure
-from .create_figure import create_linear_figure
+from .writer import flush, read_table, table_path
 
-def visualize (genome_dict, df, args):
+# more points than this cannot be told apart in a figure
+MAX_POINTS = 5000
 
-    ''' visualize top 10 contigs '''
+def contig_slice(chr_df):
+    ''' Keeps only the plotted columns of one contig, evenly thinned to MAX_POINTS '''
+
+    columns = ['pos'] + [column for column in chr_df.columns if column.endswith('_depth')]
+    chr_df  = chr_df[columns]
+
+    if len(chr_df) > MAX_POINTS:
+        chr_df = chr_df.iloc[np.linspace(0, len(chr_df) - 1, MAX_POINTS).astype(int)]
+
+    return chr_df.reset_index(drop=True)
+
+def pyramid_minimums(df, args):
+    ''' Reads the lowest depth of every window at the finest level of the depth pyramid of each platform '''
+
+    minimums = pd.DataFrame(columns = ['contig', 'pos'])
+    for column in [column for column in df.columns if column.endswith('_depth')]:
+        analysis = column[:-len('_depth')]
+        path     = table_path(args.out + '/' + analysis + '_depth_pyramid.txt', args.depth_format)
+        if not os.path.exists(path):
+            continue
+
+        df_pyramid = read_table(path, args.depth_format)
+        df_pyramid = df_pyramid[df_pyramid['windows'] == df_pyramid['windows'].max()]
+        df_pyramid = pd.DataFrame({'contig':            df_pyramid['contig'].astype(str),
+                                   'pos':               (df_pyramid['start'] + df_pyramid['end']) // 2,
+                                   analysis + '_min':   df_pyramid['min']})
+        minimums   = df_pyramid if minimums.empty else minimums.merge(df_pyramid, on = ['contig', 'pos'], how = 'outer')
+
+    return minimums.fillna(0)
+
+def minimum_slice(min_df):
+    ''' Keeps the lowest depths of one contig, taking the lowest of neighbouring windows down to MAX_POINTS '''
+
+    min_df = min_df.drop(columns = 'contig').sort_values('pos')
+
+    # thinning like contig_slice would skip the dips the pyramid is there to catch
+    if len(min_df) > MAX_POINTS:
+        starts = np.linspace(0, len(min_df), MAX_POINTS, endpoint = False).astype(int)
+        reduced = {'pos': min_df['pos'].to_numpy()[starts]}
+        for column in min_df.columns.drop('pos'):
+            reduced[column] = np.minimum.reduceat(min_df[column].to_numpy(), starts)
+        min_df = pd.DataFrame(reduced)
+
+    return min_df.reset_index(drop=True)
+
+def visualize (genome_dict, df, args, contigs = None):
+
+    ''' visualize top 10 contigs, keeping figures that exist for contigs not in contigs '''
+
+    # pycirclize and matplotlib are slow to import, so they are only loaded when figures are drawn
+    from .create_figure import create_circos_figure # pylint: disable=C0415
+    from .create_figure import create_linear_figure # pylint: disable=C0415
 
     len_threshold = top_ten(genome_dict)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers = args.threads) as executor:
+    # each contig is split off once instead of filtering the whole table for every figure
+    slices = {str(contig): chr_df for contig, chr_df in df.groupby(df['contig'].astype(str), sort=False)}
+
+    figures = []
+    for contig in genome_dict.keys():
+        figure = args.out + '/' + args.sample + '_' + genome_dict[contig]['name'] + '.png'
+        if contigs is not None and contig not in contigs and os.path.exists(figure):
+            logging.debug(f"Keeping depth figure for {genome_dict[contig]['name']}")
+            continue
+
+        if genome_dict[contig]['length'] >= len_threshold and genome_dict[contig]['name'] in slices:
+            figures.append(contig)
+
+    if not figures:
+        return
+
+    # forked processes could start with a lock held by the thread writing tables, so it finishes first.
+    # Forking keeps matplotlib loaded, where a fresh interpreter would import it again for every process
+    flush()
+
+    min_df = pyramid_minimums(df, args)
+    min_slices = {contig: contig_df for contig, contig_df in min_df.groupby('contig', sort=False)}
+
+    # matplotlib holds the GIL and pyplot is not thread safe, so figures are drawn in processes
+    with concurrent.futures.ProcessPoolExecutor(max_workers = max(1, min(args.threads, len(figures)))) as executor:
         tasks = []
-        for contig in genome_dict.keys():
-            if genome_dict[contig]['length'] >= len_threshold:
-                logging.info(f"Creating depth figure for {genome_dict[contig]['name']}")
-                if genome_dict[contig]['circ'] :
-                    future = executor.submit(create_circos_figure, genome_dict[contig], df, args)
-                    tasks.append(future)
-                else:
-                    future = executor.submit(create_linear_figure, genome_dict[contig], df, args)
-                    tasks.append(future)
-
-        ct, _ = concurrent.futures.wait(tasks,return_when=concurrent.futures.ALL_COMPLETED)
-
-        logging.debug(ct)
+        for contig in figures:
+            logging.info(f"Creating depth figure for {genome_dict[contig]['name']}")
+            chr_df = contig_slice(slices[genome_dict[contig]['name']])
+            chr_min_df = minimum_slice(min_slices[genome_dict[contig]['name']]) if genome_dict[contig]['name'] in min_slices else None
+            if genome_dict[contig]['circ'] :
+                future = executor.submit(create_circos_figure, genome_dict[contig], chr_df, args, chr_min_df)
+                tasks.append(future)
+            else:
+                future = executor.submit(create_linear_figure, genome_dict[contig], chr_df, args, chr_min_df)
+                tasks.append(future)
+
+        for future in tasks:
+            try:
+                logging.debug(f'Created {future.result()}')
+            except Exception as e: # pylint: disable=W0718
+                logging.warning(f'A depth figure could not be created : {e}')
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# pylint: disable=logging-fstring-interpolation
+
+''' Writes tables on a background thread '''
+
+import concurrent.futures
+import logging
+import os
+import pandas as pd
+
+# one writer per process, forked processes start their own
+WRITER = {'pid': None, 'executor': None, 'pending': []}
+
+def table_path(path, table_format):
+    ''' Swaps the .txt extension for the table format '''
+
+    if table_format not in ['parquet', 'feather']:
+        return path
+
+    return os.path.splitext(path)[0] + '.' + table_format
+
+def read_table(path, table_format):
+    ''' Reads a depth table back in, keeping contig names as strings '''
+
+    if table_format == 'parquet':
+        df = pd.read_parquet(path)
+    elif table_format == 'feather':
+        df = pd.read_feather(path)
+    else:
+        df = pd.read_csv(path, sep = '\t', dtype = {'contig': str})
+
+    return df
+
+def write(df, path, table_format, columns):
+    ''' Writes a table to disk '''
+
+    if columns is not None:
+        df = df[columns]
+
+    if table_format == 'parquet':
+        df.to_parquet(path, index=False)
+    elif table_format == 'feather':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        df.to_csv(path, index=False, sep = '\t')
+
+    logging.debug(f'Finished writing {path}')
+    return path
+
+def write_later(function, *args):
+    ''' Queues any writing function, its inputs must not be changed afterwards '''
+
+    if WRITER['pid'] != os.getpid():
+        WRITER['pid']      = os.getpid()
+        WRITER['executor'] = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+        WRITER['pending']  = []
+
+    WRITER['pending'].append(WRITER['executor'].submit(function, *args))
+
+def write_table(df, path, table_format = 'tsv', columns = None):
+    ''' Queues a table to be written, the table must not be changed afterwards '''
+
+    path = table_path(path, table_format)
+    write_later(write, df, path, table_format, columns)
+
+    return path
+
+def flush():
+    ''' Waits until every queued table is on disk '''
+
+    if WRITER['pid'] != os.getpid():
+        return
+
+    pending, WRITER['pending'] = WRITER['pending'], []
+    for future in pending:
+        future.result()
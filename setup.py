@@ -35,6 +35,9 @@ setup(
         "pyCirclize",
         "biopython"
     ],
+    extras_require={
+        "arrow": ["pyarrow"],
+    },
     entry_points={
         'console_scripts': [
             'circulocov=circulocov.circulocov:main'
@@ -1,5 +1,14 @@
+import json
+import os
 import pytest
 import subprocess
+import sys
+import time
+
+import pandas as pd
+import pysam
+
+from circulocov.utils.coverage import parse_coverage
 
 def run_command(cmd):
     stdout=subprocess.PIPE
@@ -31,12 +40,223 @@ def test_circulocov_ill():
     cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_illumina -t 1"
     run_command(cmd)
 
+def test_circulocov_parquet():
+    """test circulocov with parquet depth tables"""
+    pytest.importorskip("pyarrow")
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_parquet -a --depth_format parquet -t 1"
+    run_command(cmd)
+
+    df = pd.read_parquet("pytest_parquet/illumina_full_depth.parquet")
+    assert list(df.columns) == ["contig", "pos", "depth"]
+    assert (df["depth"] > 0).all()
+
+def test_circulocov_store():
+    """test circulocov with a binary depth store and exporting it"""
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_store -a --depth_format store -t 1"
+    run_command(cmd)
+    cmd = "circulocov --export_depth pytest_store/illumina_full_depth.ccd -o pytest_store/export"
+    run_command(cmd)
+
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_store_tsv -a -t 1"
+    run_command(cmd)
+
+    # the exported store is the depth table a tsv run writes
+    with open("pytest_store/export/illumina_full_depth.txt") as exported, open("pytest_store_tsv/illumina_full_depth.txt") as table:
+        assert exported.read() == table.read()
+
+def test_circulocov_stream():
+    """test circulocov counting depth one contig at a time"""
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_stream -a --stream --max_memory 0.001 -t 1"
+    run_command(cmd)
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_stream_memory -a --no-stream -t 1"
+    run_command(cmd)
+
+    for table in ["illumina_full_depth.txt", "illumina_window_depth.txt", "depth.txt"]:
+        with open("pytest_stream/" + table) as streamed, open("pytest_stream_memory/" + table) as in_memory:
+            assert streamed.read() == in_memory.read()
+
+def test_circulocov_resume():
+    """test rerunning circulocov into the same directory"""
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_resume -a --resume -t 1"
+    run_command(cmd)
+    bam_time = os.path.getmtime("pytest_resume/circulocov.sr.bam")
+    run_command(cmd)
+    # new windows are made from the coverage and depth cached beside the bam
+    run_command(cmd + " -w 50")
+
+    with open("pytest_resume/manifest.json") as manifest:
+        stages = json.load(manifest)
+    assert {"circulocov illumina mapping", "circulocov illumina counts", "circulocov illumina extract"} <= set(stages)
+    assert os.path.getmtime("pytest_resume/circulocov.sr.bam") == bam_time
+
+    windows = pd.read_csv("pytest_resume/illumina_window_depth.txt", sep="\t")
+    assert windows.groupby("contig").size().max() <= 50
+
+def test_circulocov_add():
+    """test adding nanopore reads to an illumina result"""
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_add -a -t 1"
+    run_command(cmd)
+    before = pd.read_csv("pytest_add/overall_summary.txt", sep="\t")
+    cmd = "circulocov -n tests/data/test_nanopore.fastq.gz -g tests/data/test.fasta -o pytest_add -a --add -t 1"
+    run_command(cmd)
+
+    # the new platform is counted next to the illumina results, which are kept as they were
+    df = pd.read_csv("pytest_add/overall_summary.txt", sep="\t")
+    assert (df.loc[df["contigs"] != "missing", ["nanopore_numreads", "nanopore_meandepth"]] > 0).all().all()
+    pd.testing.assert_frame_equal(df[before.columns], before)
+
+    depth = pd.read_csv("pytest_add/depth.txt", sep="\t")
+    assert depth["nanopore_depth"].sum() > 0
+    assert depth["illumina_depth"].sum() > 0
+
+def test_circulocov_filters():
+    """test circulocov with read filters"""
+    # at 150 bases, soft clipped reads are kept by their length from the cigar but not by their aligned length
+    for min_length in [50, 150]:
+        out = "pytest_filters_" + str(min_length)
+        cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o " + out + " -a --min_mapq 20 --exclude_flags 0xF04 --min_length " + str(min_length) + " -t 1"
+        run_command(cmd)
+
+        # only alignments passing every filter are counted, with the length measured from the cigar like samtools coverage -l
+        expected = {}
+        aligned  = 0
+        with pysam.AlignmentFile(out + "/circulocov.sr.bam") as alignments:
+            for read in alignments:
+                if read.flag & 0xF04 or read.mapping_quality < 20 or read.infer_query_length() < min_length:
+                    continue
+                expected[read.reference_name] = expected.get(read.reference_name, 0) + 1
+                aligned += read.query_alignment_length >= min_length
+
+        df = pd.read_csv(out + "/illumina_cov.txt", sep="\t")
+        counted = {str(contig): numreads for contig, numreads in zip(df["#rname"], df["numreads"]) if numreads}
+        assert counted == expected
+        assert (aligned < sum(expected.values())) == (min_length == 150)
+
+def test_circulocov_samplesheet():
+    """test circulocov with a sample sheet"""
+    cmd = "circulocov --samplesheet tests/data/samplesheet.tsv -o pytest_batch -t 2"
+    run_command(cmd)
+
+    df = pd.read_csv("pytest_batch/overall_summary.txt", sep="\t")
+    assert set(df["sample"]) == {"test_paired", "test_single"}
+
+def test_circulocov_lift():
+    """test circulocov with alignments lifted off the padding"""
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_lift -a --lift -t 1"
+    run_command(cmd)
+
+def test_circulocov_lift_numreads():
+    """test circulocov counts reads split at the end of a circular contig once with --lift"""
+    for out, option in [("pytest_lift_numreads", ""), ("pytest_lift_numreads_all", " -a")]:
+        cmd = "circulocov -n tests/data/test_nanopore.fastq.gz -g tests/data/test.fasta -o " + out + option + " --lift -t 1"
+        run_command(cmd)
+
+        names = {}
+        split = 0
+        with pysam.AlignmentFile(out + "/circulocov.map-ont.bam") as alignments:
+            for read in alignments:
+                split += read.has_tag("ZC")
+                if not read.flag & 0x704:
+                    names.setdefault(read.reference_name, set()).add(read.query_name)
+        assert split
+
+        df = pd.read_csv(out + "/nanopore_cov.txt", sep="\t")
+        assert {str(contig): numreads for contig, numreads in zip(df["#rname"], df["numreads"])} == {contig: len(reads) for contig, reads in names.items()}
+
+def test_circulocov_lift_mapq():
+    """test circulocov keeps alignments at the start of circular contigs with --lift and --min_mapq"""
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_lift_mapq -a --lift --min_mapq 20 -t 1"
+    run_command(cmd)
+
+    # hits that tied with their padded copy get their mapping quality back
+    with pysam.AlignmentFile("pytest_lift_mapq/circulocov.sr.bam") as alignments:
+        start = [read.mapping_quality for read in alignments.fetch("3", 0, 10000) if not read.flag & 0x904]
+    assert start
+    assert sum(quality == 0 for quality in start) < len(start) / 10
+
+    # so the start of the contig is as deep as the rest of it
+    df    = pd.read_csv("pytest_lift_mapq/illumina_full_depth.txt", sep="\t")
+    depth = df.loc[df["contig"].astype(str) == "3"]
+    assert depth.loc[depth["pos"] <= 10000, "depth"].sum() / 10000 > 0.5 * depth.loc[depth["pos"] > 10000, "depth"].sum() / 31559
+
+def test_circulocov_subsample():
+    """test circulocov with subsampled reads"""
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_subsample --subsample_fraction 0.5 -t 1"
+    run_command(cmd)
+
+    df  = pd.read_csv("pytest_subsample/overall_summary.txt", sep="\t")
+    row = df.loc[df["contigs"] == "all"].iloc[0]
+    assert 0.3 < row["illumina_subsample"] < 0.7
+    assert abs(row["illumina_extrapolated_meandepth"] - row["illumina_meandepth"] / row["illumina_subsample"]) < 0.05
+
+    # mates are kept or dropped together
+    with pysam.AlignmentFile("pytest_subsample/circulocov.sr.bam") as alignments:
+        names = [read.query_name for read in alignments if not read.flag & 0x900]
+    assert all(names.count(name) == 2 for name in set(names))
+
+def test_circulocov_index_cache():
+    """test circulocov reusing minimap2 indexes kept in a cache directory"""
+    cmd = "circulocov -i tests/data/test_R1.fastq.gz tests/data/test_R2.fastq.gz -g tests/data/test.fasta -o pytest_index_cache --index_cache pytest_index_cache_dir -t 1"
+    run_command(cmd)
+    indexes = os.listdir("pytest_index_cache_dir")
+    assert len(indexes) == 1 and indexes[0].endswith(".sr.mmi")
+
+    # the second run maps against the same index
+    run_command(cmd)
+    assert os.listdir("pytest_index_cache_dir") == indexes
+
+def test_circulocov_api():
+    """test running circulocov from python"""
+    from circulocov import Config, run
+
+    result = run(Config(genome = "tests/data/test.fasta",
+                        illumina = ["tests/data/test_R1.fastq.gz", "tests/data/test_R2.fastq.gz"],
+                        out = "pytest_api",
+                        all = True,
+                        threads = 1))
+
+    assert not result.summary.empty
+    assert "illumina_numreads" in result.coverage.columns
+    assert "illumina_depth" in result.depth.columns
+
 def test_version():
     """test circulocov version"""    
     cmd = "circulocov -v"
     run_command(cmd)
 
+def test_version_startup():
+    """test circulocov -v does not load the pipeline"""
+    # checks what was imported instead of timing it, so a busy machine cannot fail it
+    code = ("import sys\n"
+            "from circulocov.circulocov import main\n"
+            "sys.argv = ['circulocov', '-v']\n"
+            "try:\n"
+            "    main()\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print('loaded:', *[module for module in ['pandas', 'pysam', 'matplotlib'] if module in sys.modules])\n")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.splitlines()[-1].strip() == "loaded:"
+
 def test_help():
     """test circulocov help"""    
     cmd = "circulocov -h"
-    run_command(cmd)
\ No newline at end of file
+    run_command(cmd)
+
+def test_coverage_benchmark():
+    """test parsing a coverage table for a 50k contig assembly"""
+    header = "#rname\tstartpos\tendpos\tnumreads\tcovbases\tcoverage\tmeandepth\tmeanbaseq\tmeanmapq"
+    rows = [f"contig_{i}\t1\t{1000 + i}\t{i % 97}\t{900 + i % 100}\t{90 + i % 10}.5\t{i % 50}.25\t35.1\t{i % 61}" for i in range(50000)]
+
+    start = time.perf_counter()
+    df = parse_coverage("\n".join([header] + rows) + "\n")
+    elapsed = time.perf_counter() - start
+
+    assert len(df.index) == 50000
+    assert df['endpos'].dtype == 'int64'
+    assert df['numreads'].dtype == 'int64'
+    assert df['covbases'].dtype == 'int64'
+    assert df['meandepth'].dtype == 'float64'
+    assert df['meanmapq'].dtype == 'float64'
+    # a loose ceiling so slow or busy machines do not fail it, benchmarks/ holds the real timings
+    assert elapsed < 60